@@ -5,6 +5,7 @@ from __future__ import annotations
 import os
 import glob
 import csv
+from itertools import islice
 from typing import Dict
 import sqlite3
 from osgeo import ogr, osr
@@ -308,7 +309,7 @@ def load_dgo_attributes(database, fields, where_clause=None):
     return dgos
 
 
-def write_db_attributes(database, reaches, fields, set_null_first=True, summarize=True):
+def write_db_attributes(database, reaches, fields, set_null_first=True, summarize=True, batch_size=None):
 
     if len(reaches) < 1:
         return
@@ -321,20 +322,22 @@ def write_db_attributes(database, reaches, fields, set_null_first=True, summariz
     if set_null_first is True:
         [curs.execute('UPDATE ReachAttributes SET {} = NULL'.format(field)) for field in fields]
 
-    results = []
-    for reachid, values in reaches.items():
-        results.append([values[field] if field in values else None for field in fields])
-        results[-1].append(reachid)
+    results = ([values[field] if field in values else None for field in fields] + [reachid] for reachid, values in reaches.items())
 
     sql = 'UPDATE ReachAttributes SET {} WHERE ReachID = ?'.format(','.join(['{}=?'.format(field) for field in fields]))
-    curs.executemany(sql, results)
+    if batch_size:
+        # Send the updates in batches (all within the one transaction) to bound memory on large networks
+        for batch in iter(lambda: list(islice(results, batch_size)), []):
+            curs.executemany(sql, batch)
+    else:
+        curs.executemany(sql, results)
     conn.commit()
 
     if summarize is True:
         [summarize_reaches(database, field) for field in fields]
 
 
-def write_db_igo_attributes(database, features, fields, set_null_first=True, summarize=True):
+def write_db_igo_attributes(database, features, fields, set_null_first=True, summarize=True, batch_size=None):
 
     if len(features) < 1:
         return
@@ -347,20 +350,22 @@ def write_db_igo_attributes(database, features, fields, set_null_first=True, sum
     if set_null_first is True:
         [curs.execute('UPDATE IGOAttributes SET {} = NULL'.format(field)) for field in fields]
 
-    results = []
-    for reachid, values in features.items():
-        results.append([values[field] if field in values else None for field in fields])
-        results[-1].append(reachid)
+    results = ([values[field] if field in values else None for field in fields] + [reachid] for reachid, values in features.items())
 
     sql = 'UPDATE IGOAttributes SET {} WHERE IGOID = ?'.format(','.join(['{}=?'.format(field) for field in fields]))
-    curs.executemany(sql, results)
+    if batch_size:
+        # Send the updates in batches (all within the one transaction) to bound memory on large networks
+        for batch in iter(lambda: list(islice(results, batch_size)), []):
+            curs.executemany(sql, batch)
+    else:
+        curs.executemany(sql, results)
     conn.commit()
 
     if summarize is True:
         [summarize_reaches(database, field) for field in fields]
 
 
-def write_db_dgo_attributes(database, features, fields, set_null_first=True, summarize=True):
+def write_db_dgo_attributes(database, features, fields, set_null_first=True, summarize=True, batch_size=None):
 
     if len(features) < 1:
         return
@@ -373,13 +378,15 @@ def write_db_dgo_attributes(database, features, fields, set_null_first=True, sum
     if set_null_first is True:
         [curs.execute('UPDATE DGOAttributes SET {} = NULL'.format(field)) for field in fields]
 
-    results = []
-    for reachid, values in features.items():
-        results.append([values[field] if field in values else None for field in fields])
-        results[-1].append(reachid)
+    results = ([values[field] if field in values else None for field in fields] + [reachid] for reachid, values in features.items())
 
     sql = 'UPDATE DGOAttributes SET {} WHERE DGOID = ?'.format(','.join(['{}=?'.format(field) for field in fields]))
-    curs.executemany(sql, results)
+    if batch_size:
+        # Send the updates in batches (all within the one transaction) to bound memory on large networks
+        for batch in iter(lambda: list(islice(results, batch_size)), []):
+            curs.executemany(sql, batch)
+    else:
+        curs.executemany(sql, results)
     conn.commit()
 
     if summarize is True:
@@ -1,6 +1,8 @@
 """
 An alternative to the original combined_fis.py, in which the FIS can be modified for sensitivity analysis.
 This script is meant to be imported into brat.py and called in place of combined_fis.py.
+It imports its MFs and defuzzification from fis_helpers.py, which must ship alongside it and be importable
+as a top-level module (i.e. in the same directory, or on sys.path), wherever this script is placed.
 A similar version is provided for the combined FIS.
 
 Much of the code is copied from the original combined_fis.py, credits:
@@ -17,13 +19,15 @@ July 2025
 import os
 import sys
 import argparse
+from functools import lru_cache
+from operator import itemgetter
 import traceback
 import numpy as np
-import skfuzzy as fuzz
-import matplotlib.pyplot as plt
-from skfuzzy import control as ctrl
-from rscommons.database import load_attributes, write_db_attributes, load_dgo_attributes, write_db_dgo_attributes
-from rscommons import ProgressBar, Logger, dotenv
+from rscommons.database import load_attributes, write_db_attributes, load_dgo_attributes, write_db_dgo_attributes, execute_query
+from rscommons import Logger, ProgressBar, dotenv
+from fis_helpers import density_terms, density_mfs, density_centroid, tri_mf, trap_mf, gbell_mf, gauss_mf, trap_params, trap_mf_table, check_mf_order
+# numba is optional (see fis_helpers). Without it the rule activations fall back to the pure NumPy version
+from fis_helpers import njit, prange
 
 
 adjustment_types = ['shift', 'scale', 'shape']
@@ -35,9 +39,12 @@ adjustment_types = ['shift', 'scale', 'shape']
     # shape: must be adjusted manually within this script by changing the MFs in calculate_vegetation_fis_custom()
 '''
 
+# features run through the FIS at a time. Small enough that a chunk's memberships and activations stay in cache
+fis_chunk_size = 4096
 
-def combined_fis(database: str, label: str, veg_type: str, max_drainage_area: float, dgo: bool = False, 
-                 adjustment_type: str = None, adjustment_values: list = None):
+
+def combined_fis(database: str, label: str, veg_type: str, max_drainage_area: float, dgo: bool = False,
+                 adjustment_type: str = None, adjustment_values: list = None, plot_mfs: bool = False):
     """
     Combined beaver dam capacity FIS
     :param network: Shapefile path containing necessary FIS inputs
@@ -46,22 +53,28 @@ def combined_fis(database: str, label: str, veg_type: str, max_drainage_area: fl
     :param max_drainage_area: Max drainage above which features are not processed.
     :param adjustment_type: Type of adjustment to apply ('shift', 'scale', or 'shape')
     :param adjustment_values: List of values for adjustments (shifts or scaling factors)
+    :param plot_mfs: Show plots of the adjusted MFs (off by default so sweeps don't stop on every run)
     :return: None
     """
-    
+
+    log = Logger('Combined FIS')
+
     # handle adjustments
     if adjustment_type:
         if adjustment_type not in adjustment_types:
             raise ValueError(f"Invalid adjustment type: {adjustment_type}. Must be one of {adjustment_types}.")
         if not adjustment_values and adjustment_type != 'shape':
             raise ValueError(f"Please provide adjustment values: list of [sp2, splow, slope] shift amounts or scale factors.")
-        if adjustment_type == 'scale' and [val <= 0 for val in adjustment_values]:
+        if adjustment_type != 'shape' and len(adjustment_values) != 3:
+            raise ValueError(f"Invalid adjustment values: {adjustment_values}. Must be a list of three [sp2, splow, slope] shift amounts or scale factors.")
+        if adjustment_type == 'scale' and any(val <= 0 for val in adjustment_values):
             raise ValueError(f"Invalid scale factor: {adjustment_values}. Must be greater than 0.")
         if adjustment_type == 'shape':
             log.warning("Shape adjustments must be done manually in the code. No automatic adjustments applied.")
             adjustment_values = None
+        # build the adjusted MFs now so invalid adjustments fail before anything is written. They are cached for the run
+        build_combined_mfs(adjustment_type, tuple(adjustment_values) if adjustment_values else None)
 
-    log = Logger('Combined FIS')
     log.info('Processing {} vegetation'.format(label))
 
     veg_fis_field = 'oVC_{}'.format(veg_type)
@@ -69,27 +82,31 @@ def combined_fis(database: str, label: str, veg_type: str, max_drainage_area: fl
     dam_count_field = 'mCC_{}_CT'.format(veg_type)
 
     fields = [veg_fis_field, 'iGeo_Slope', 'iGeo_DA', 'iHyd_SP2', 'iHyd_SPLow', 'iGeo_Len', 'ReachCode']
+    where_clause = ' AND '.join(['({} IS NOT NULL)'.format(f) for f in fields])
 
-    if not dgo:
-        reaches = load_attributes(database, fields, ' AND '.join(['({} IS NOT NULL)'.format(f) for f in fields]))
-        if adjustment_type:
-            calculate_combined_fis_custom(reaches, veg_fis_field, capacity_field, dam_count_field, max_drainage_area, adjustment_type, adjustment_values)
-        else:
-            calculate_combined_fis(reaches, veg_fis_field, capacity_field, dam_count_field, max_drainage_area)
-        write_db_attributes(database, reaches, [capacity_field, dam_count_field], log)
+    if max_drainage_area:
+        # features above the max drainage area (other than artificial paths) have zero capacity.
+        # Set them directly in the database so they are never loaded or run through the FIS
+        table, view, id_field = ('DGOAttributes', 'vwDgos', 'DGOID') if dgo else ('ReachAttributes', 'vwReaches', 'ReachID')
+        execute_query(database, 'UPDATE {0} SET {1} = 0, {2} = 0 WHERE {3} IN (SELECT {3} FROM {4} WHERE {5} AND iGeo_DA >= {6} AND ReachCode <> 33600)'.format(
+            table, capacity_field, dam_count_field, id_field, view, where_clause, max_drainage_area), 'Setting zero capacity above max drainage area')
+        where_clause += ' AND (iGeo_DA < {} OR ReachCode = 33600)'.format(max_drainage_area)
+
+    features = load_dgo_attributes(database, fields, where_clause) if dgo else load_attributes(database, fields, where_clause)
+    if adjustment_type:
+        calculate_combined_fis_custom(features, veg_fis_field, capacity_field, dam_count_field, max_drainage_area, adjustment_type, adjustment_values, plot_mfs)
     else:
-        feature_values = load_dgo_attributes(database, fields, ' AND '.join(['({} IS NOT NULL)'.format(f) for f in fields]))
-        if adjustment_type:
-            calculate_combined_fis_custom(reaches, veg_fis_field, capacity_field, dam_count_field, max_drainage_area, adjustment_type, adjustment_values)
-        else:
-            calculate_combined_fis(feature_values, veg_fis_field, capacity_field, dam_count_field, max_drainage_area)
-        write_db_dgo_attributes(database, feature_values, [capacity_field, dam_count_field], log)
+        calculate_combined_fis(features, veg_fis_field, capacity_field, dam_count_field, max_drainage_area)
+    # set_null_first must stay False: clearing the fields first would wipe the zero capacities
+    # written above for features over the max drainage area, which are not loaded or rewritten here
+    write_attributes = write_db_dgo_attributes if dgo else write_db_attributes
+    write_attributes(database, features, [capacity_field, dam_count_field], set_null_first=False, batch_size=10000)
 
     log.info('Process completed successfully.')
 
 
 def calculate_combined_fis_custom(feature_values: dict, veg_fis_field: str, capacity_field: str, dam_count_field: str, max_drainage_area: float,
-                                  adj_type: str, adj_vals: list):
+                                  adj_type: str, adj_vals: list, plot_mfs: bool = False):
     """
     Calculate dam capacity and density using combined FIS
     :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
@@ -99,297 +116,43 @@ def calculate_combined_fis_custom(feature_values: dict, veg_fis_field: str, capa
     :param max_drainage_area: Reaches with drainage area greater than this threshold will have zero capacity
     :param adj_type: Type of adjustment to apply ('shift', 'scale', or 'shape')
     :param vals: List of values for adjustments (shifts or scaling factors)
+    :param plot_mfs: Show plots of the adjusted MFs
     :return: Insert the dam capacity and density values to the feature_values dictionary
     """
 
-    log = Logger('Combined FIS')
-    log.info('Initializing Combined FIS')
-
-    if not max_drainage_area:
-        log.warning('Missing max drainage area. Calculating combined FIS without max drainage threshold.')
-
-    # get arrays for fields of interest
-    feature_count = len(feature_values)
-    reachid_array = np.zeros(feature_count, np.int64)
-    reachcode_array = np.zeros(feature_count, np.int64)
-    veg_array = np.zeros(feature_count, np.float64)
-    hydq2_array = np.zeros(feature_count, np.float64)
-    hydlow_array = np.zeros(feature_count, np.float64)
-    slope_array = np.zeros(feature_count, np.float64)
-    drain_array = np.zeros(feature_count, np.float64)
-
-    counter = 0
-    for reach_id, values in feature_values.items():
-        reachid_array[counter] = reach_id
-        reachcode_array[counter] = values['ReachCode']
-        veg_array[counter] = values[veg_fis_field]
-        hydlow_array[counter] = values['iHyd_SPLow']
-        hydq2_array[counter] = values['iHyd_SP2']
-        slope_array[counter] = values['iGeo_Slope']
-        drain_array[counter] = values['iGeo_DA']
-        counter += 1
-
-    # Adjust inputs to be within FIS membership range
-    veg_array[veg_array < 0] = 0
-    veg_array[veg_array > 45] = 45
-
-    hydq2_array[hydq2_array < 0] = 0.0001
-    hydq2_array[hydq2_array > 10000] = 10000
+    # build membership functions for each antecedent and consequent object --- apply adjustments here
+    # the MFs only depend on the adjustment so they are cached across runs
+    mfs = build_combined_mfs(adj_type, tuple(adj_vals) if adj_vals else None)
 
-    hydlow_array[hydlow_array < 0] = 0.0001
-    hydlow_array[hydlow_array > 10000] = 10000
-    slope_array[slope_array > 1] = 1
+    calculate_combined_fis(feature_values, veg_fis_field, capacity_field, dam_count_field, max_drainage_area, mfs)
 
-    # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
-    ovc = ctrl.Antecedent(np.arange(0, 45, 0.01), 'input1')
-    sp2 = ctrl.Antecedent(np.arange(0, 10000, 1), 'input2')
-    splow = ctrl.Antecedent(np.arange(0, 10000, 1), 'input3')
-    slope = ctrl.Antecedent(np.arange(0, 1, 0.0001), 'input4')
-    density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')
+    if plot_mfs:
+        Logger('Combined FIS').info('Visualizing Adjusted MFs...')
+        plot_combined_mfs(mfs)
 
-    # build membership functions for each antecedent and consequent object --- apply adjustments here
-    
-    # we do NOT adjust ovc or density
-    ovc['none'] = fuzz.trimf(ovc.universe, [0, 0, 0.1])
-    ovc['rare'] = fuzz.trapmf(ovc.universe, [0, 0.1, 0.5, 1.5])
-    ovc['occasional'] = fuzz.trapmf(ovc.universe, [0.5, 1.5, 4, 8])
-    ovc['frequent'] = fuzz.trapmf(ovc.universe, [4, 8, 12, 25])
-    ovc['pervasive'] = fuzz.trapmf(ovc.universe, [12, 25, 45, 45])
-
-    density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
-    density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
-    density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
-    density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
-    density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
 
-    if adj_type == 'shift':
-        # we shift all values by the constant except min and max bounds
-        c1 = adj_vals[0]
-        sp2['persists'] = fuzz.trapmf(sp2.universe, [0, 0, 1000+c1, 1200+c1])
-        sp2['breach'] = fuzz.trimf(sp2.universe, [1000+c1, 1200+c1, 1600+c1])
-        sp2['oblowout'] = fuzz.trimf(sp2.universe, [1200+c1, 1600+c1, 2400+c1])
-        sp2['blowout'] = fuzz.trapmf(sp2.universe, [1600+c1, 2400+c1, 10000, 10000])
+def plot_combined_mfs(mfs: dict):
+    """
+    Show plots of the combined FIS MFs
+    :param mfs: Dictionary of (function, parameters) MFs keyed by FIS variable label then term
+    :return: None
+    """
 
-        c2 = adj_vals[1]
-        splow['can'] = fuzz.trapmf(splow.universe, [0, 0, 150+c2, 175+c2])
-        splow['probably'] = fuzz.trapmf(splow.universe, [150+c2, 175+c2, 180+c2, 190+c2])
-        splow['cannot'] = fuzz.trapmf(splow.universe, [180+c2, 190+c2, 10000, 10000])
+    import matplotlib.pyplot as plt
 
-        c3 = adj_vals[2]
-        slope['flat'] = fuzz.trapmf(slope.universe, [0, 0, 0.0002+c3, 0.005+c3])
-        slope['can'] = fuzz.trapmf(slope.universe, [0.0002+c3, 0.005+c3, 0.12+c3, 0.15+c3])
-        slope['probably'] = fuzz.trapmf(slope.universe, [0.12+c3, 0.15+c3, 0.17+c3, 0.23+c3])
-        slope['cannot'] = fuzz.trapmf(slope.universe, [0.17+c3, 0.23+c3, 1, 1])
-    
-    elif adj_type == 'scale':
-        # scaling equations:
-            #   triangles (a,b,c)
-            #       a = b - ((b - a) * scalefactor)
-            #       c = b + ((c - b) * scalefactor)
-            #       even though the triangle may not be isosceles, we use b to yield consistent MF intersection
-            #   trapezoids (a,b,c,d)
-            #       a = b - ((b-a) * scalefactor)
-            #       d = c + ((d-c) * scalefactor)
-        
-        trapezoids = {
-            'sp2': [
-                ['persists', [0, 0, 1000, 1200]],
-                ['blowout', [1600, 2400, 10000, 10000]]
-            ],
-            'splow': [
-                ['can', [0, 0, 150, 175]],
-                ['probably', [150, 175, 180, 190]],
-                ['cannot', [80, 190, 10000, 10000]]
-            ],
-            'slope': [
-                ['flat', [0, 0, 0.0002, 0.005]],
-                ['can', [0.0002, 0.005, 0.12, 0.15]],
-                ['probably', [0.12, 0.15, 0.17, 0.23]],
-                ['cannot', [0.17, 0.23, 1, 1]]
-            ]
-        }
-        
-        sp2_triangles = {   # only sp2 uses triangles
-            'breach': [1000, 1200, 1600],
-            'oblowout': [1200, 1600, 2400]
-        }
-        
-        # scale trapezoids iteratively
-        for var, mfs in trapezoids.items():
-            for category, abcd in mfs:
-                if var == 'sp2':
-                    a, b, c, d = calculate_trap_scale(abcd, adj_vals[0])
-                    sp2[category] = fuzz.trapmf(sp2.universe, [a, b, c, d])
-                if var == 'splow':
-                    a, b, c, d = calculate_trap_scale(abcd, adj_vals[1])
-                    splow[category] = fuzz.trapmf(splow.universe, [a, b, c, d])
-                if var == 'slope':
-                    a, b, c, d = calculate_trap_scale(abcd, adj_vals[2])
-                    slope[category] = fuzz.trapmf(slope.universe, [a, b, c, d])
-        
-        # scale triangles iteratively
-        for cat, abc in sp2_triangles.items():
-            scale = adj_vals[0]
-            b = abc[1]
-            a = b - ((b - abc[0]) * scale)
-            c = b -((abc[2] - b) * scale)
-            sp2[cat] = fuzz.trimf(sp2.universe, [a, b, c])
-        
-    elif adj_type == 'shape':
-        log.info("Running custom-defined MF shapes.")
-        # CUSTOM SHAPES DEFINED HERE
-        sp2['persists'] = fuzz.gbellmf(sp2.universe, 500, 5, 500)
-        sp2['breach'] = fuzz.gaussmf(sp2.universe, 1200, 150)
-        sp2['oblowout'] = fuzz.gaussmf(sp2.universe, 1700, 250)
-        sp2['blowout'] = fuzz.gbellmf(sp2.universe, 4200, 20, 6200)
-
-        splow['can'] = fuzz.gbellmf(splow.universe, 85, 8, 75)
-        splow['probably'] = fuzz.gbellmf(splow.universe, 10, 2, 170)
-        splow['cannot'] = fuzz.gbellmf(splow.universe, 4910, 750, 5090)
-
-        slope['flat'] = fuzz.gbellmf(slope.universe, 0.0025, 3, 0.0025)
-        slope['can'] = fuzz.gbellmf(slope.universe, 0.07, 3, 0.06)
-        slope['probably'] = fuzz.gbellmf(slope.universe, 0.035, 1.5, 0.165)
-        slope['cannot'] = fuzz.gbellmf(slope.universe, 0.38, 14, 0.585)
-
-
-    # build fis rule table
-    log.info('Building FIS rule table')
-    comb_ctrl = ctrl.ControlSystem([
-        ctrl.Rule(ovc['none'], density['none']),
-        ctrl.Rule(splow['cannot'], density['none']),
-        ctrl.Rule(slope['cannot'], density['none']),
-        ctrl.Rule(ovc['rare'] & sp2['persists'] & splow['can'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['persists'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['breach'] & splow['can'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['breach'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['oblowout'] & splow['can'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['oblowout'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['blowout'] & splow['can'] & ~slope['cannot'], density['none']),
-        ctrl.Rule(ovc['rare'] & sp2['blowout'] & splow['probably'] & ~slope['cannot'], density['none']),
-        ctrl.Rule(ovc['occasional'] & sp2['persists'] & splow['can'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['persists'] & splow['probably'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['breach'] & splow['can'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['breach'] & splow['probably'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['oblowout'] & splow['can'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['oblowout'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['occasional'] & sp2['blowout'] & splow['can'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['occasional'] & sp2['blowout'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['can'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['probably'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['can'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['probably'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['can'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['none']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['flat'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['can'], density['pervasive']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['flat'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['can'], density['pervasive']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['probably'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['can'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['probably'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['can'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['probably'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['can'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['rare'])
-    ])
-
-    comb_fis = ctrl.ControlSystemSimulation(comb_ctrl)
-
-    # calculate defuzzified centroid value for density 'none' MF group
-    # this will be used to re-classify output values that fall in this group
-    # important: will need to update the array (x) and MF values (mfx) if the
-    # density 'none' values are changed in the model
-    x_vals = np.arange(0, 45, 0.01)
-    mfx = fuzz.trimf(x_vals, [0, 0, 0.1])
-    defuzz_centroid = round(fuzz.defuzz(x_vals, mfx, 'centroid'), 6)
-
-    progbar = ProgressBar(len(reachid_array), 50, "Combined FIS")
-    counter = 0
-
-    for i, reach_id in enumerate(reachid_array):
-
-        capacity = 0.0
-        # Only compute FIS if the reach has less than user-defined max drainage area.
-        # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
-        if not max_drainage_area or drain_array[i] < max_drainage_area:
-
-            comb_fis.input['input1'] = veg_array[i]
-            comb_fis.input['input2'] = hydq2_array[i]
-            comb_fis.input['input3'] = hydlow_array[i]
-            comb_fis.input['input4'] = slope_array[i]
-            comb_fis.compute()
-            capacity = comb_fis.output['result']
-
-            # Combined FIS result cannot be higher than limiting vegetation FIS result
-            if capacity > veg_array[i]:
-                capacity = veg_array[i]
-
-            if round(capacity, 6) == defuzz_centroid:
-                capacity = 0.0
-
-        elif drain_array[i] >= max_drainage_area and reachcode_array[i] == 33600:
-
-            comb_fis.input['input1'] = veg_array[i]
-            comb_fis.input['input2'] = hydq2_array[i]
-            comb_fis.input['input3'] = hydlow_array[i]
-            comb_fis.input['input4'] = slope_array[i]
-            comb_fis.compute()
-            capacity = comb_fis.output['result']
-
-            # Combined FIS result cannot be higher than limiting vegetation FIS result
-            if capacity > veg_array[i]:
-                capacity = veg_array[i]
-
-            if round(capacity, 6) == defuzz_centroid:
-                capacity = 0.0
-
-        count = capacity * (feature_values[reach_id]['iGeo_Len'] / 1000.0)
-        count = 1.0 if 0 < count < 1 else count
-
-        feature_values[reach_id][capacity_field] = round(capacity, 2)
-        feature_values[reach_id][dam_count_field] = round(count, 2)
-
-        counter += 1
-        progbar.update(counter)
-
-    '''VISUALIZE MFS'''
-    log.info('Visualizing Adjusted MFs...')
+    # universe (plot x axis) of each combined FIS variable.
+    # The oVC and density MFs only break at multiples of 0.1, so a 0.1 step draws them exactly
+    universes = {
+        'input1': np.arange(0, 45, 0.1),
+        'input2': np.arange(0, 10000, 1),
+        'input3': np.arange(0, 10000, 1),
+        'input4': np.arange(0, 1, 0.0001),
+        'result': np.arange(0, 45, 0.1)
+    }
 
     # oVC
-    for label, color in zip(list(ovc.terms.keys()), ['r', 'orange', 'y', 'g', 'b']):
-        plt.plot(ovc.universe, ovc.terms[label].mf, color=color, linewidth=1.5, label=label.capitalize())
+    for (label, (mf, params)), color in zip(mfs['input1'].items(), ['r', 'orange', 'y', 'g', 'b']):
+        plt.plot(universes['input1'], mf(universes['input1'], *params), color=color, linewidth=1.5, label=label.capitalize())
     plt.xlabel('oVC (Vegetation) Suitability')
     plt.ylabel('Membership')
     plt.legend()
@@ -397,8 +160,8 @@ def calculate_combined_fis_custom(feature_values: dict, veg_fis_field: str, capa
     plt.show()
 
     # SP2
-    for label, color in zip(list(sp2.terms.keys()), ['g', 'y', 'orange', 'r']):
-        plt.plot(sp2.universe, sp2.terms[label].mf, color=color, linewidth=1.5, label=label.capitalize())
+    for (label, (mf, params)), color in zip(mfs['input2'].items(), ['g', 'y', 'orange', 'r']):
+        plt.plot(universes['input2'], mf(universes['input2'], *params), color=color, linewidth=1.5, label=label.capitalize())
     plt.xlabel('SP2 Peak Flow (watts)')
     plt.ylabel('Membership')
     plt.legend()
@@ -407,8 +170,8 @@ def calculate_combined_fis_custom(feature_values: dict, veg_fis_field: str, capa
     plt.show()
 
     # SPLow
-    for label, color in zip(list(splow.terms.keys()), ['g', 'y', 'r']):
-        plt.plot(splow.universe, splow.terms[label].mf, color=color, linewidth=1.5, label=label.capitalize())
+    for (label, (mf, params)), color in zip(mfs['input3'].items(), ['g', 'y', 'r']):
+        plt.plot(universes['input3'], mf(universes['input3'], *params), color=color, linewidth=1.5, label=label.capitalize())
     plt.xlabel('SPLow Baseflow (watts)')
     plt.ylabel('Membership')
     plt.legend()
@@ -417,8 +180,8 @@ def calculate_combined_fis_custom(feature_values: dict, veg_fis_field: str, capa
     plt.show()
 
     # Slope
-    for label, color in zip(list(slope.terms.keys()), ['b', 'g', 'y', 'r']):
-        plt.plot(slope.universe, slope.terms[label].mf, color=color, linewidth=1.5, label=label.capitalize())
+    for (label, (mf, params)), color in zip(mfs['input4'].items(), ['b', 'g', 'y', 'r']):
+        plt.plot(universes['input4'], mf(universes['input4'], *params), color=color, linewidth=1.5, label=label.capitalize())
     plt.xlabel('Slope')
     plt.ylabel('Membership')
     plt.legend()
@@ -428,16 +191,93 @@ def calculate_combined_fis_custom(feature_values: dict, veg_fis_field: str, capa
 
     # Density
     fig, axs = plt.subplots(1, 1, figsize=(12, 4))
-    for label, color in zip(list(density.terms.keys()), ['r', 'orange', 'y', 'g', 'b']):
-        axs.plot(density.universe, density.terms[label].mf, color=color, linewidth=1.5, label=label.capitalize())
+    for (label, (mf, params)), color in zip(mfs['result'].items(), ['r', 'orange', 'y', 'g', 'b']):
+        axs.plot(universes['result'], mf(universes['result'], *params), color=color, linewidth=1.5, label=label.capitalize())
     plt.xlabel('Overall Dam Capacity')
     plt.ylabel('Membership')
     plt.legend()
     plt.tight_layout()
     plt.show()
-    
-    progbar.finish()
-    log.info('Done')
+
+
+@lru_cache(maxsize=64)
+def build_combined_mfs(adj_type: str, adj_vals: tuple) -> dict:
+    """
+    Build the adjusted combined FIS MFs. Each MF is held as (function, parameters) so it can
+    be evaluated directly on the reach inputs. Cached, so the returned dictionary must not be modified
+    :param adj_type: Type of adjustment to apply ('shift', 'scale', or 'shape')
+    :param adj_vals: Tuple of values for adjustments (shifts or scaling factors) for [sp2, splow, slope]
+    :return: Dictionary of (function, parameters) MFs keyed by FIS variable label then term
+    """
+
+    log = Logger('Combined FIS')
+
+    # we do NOT adjust ovc or density
+    mfs = {var: dict(terms) for var, terms in combined_mfs.items()}
+
+    if adj_type == 'shift':
+        # we shift all values by the constant except min and max bounds
+        c1 = adj_vals[0]
+        mfs['input2'] = {
+            'persists': (trap_mf, [0, 0, 1000+c1, 1200+c1]),
+            'breach': (tri_mf, [1000+c1, 1200+c1, 1600+c1]),
+            'oblowout': (tri_mf, [1200+c1, 1600+c1, 2400+c1]),
+            'blowout': (trap_mf, [1600+c1, 2400+c1, 10000, 10000])
+        }
+
+        c2 = adj_vals[1]
+        mfs['input3'] = {
+            'can': (trap_mf, [0, 0, 150+c2, 175+c2]),
+            'probably': (trap_mf, [150+c2, 175+c2, 180+c2, 190+c2]),
+            'cannot': (trap_mf, [180+c2, 190+c2, 10000, 10000])
+        }
+
+        c3 = adj_vals[2]
+        mfs['input4'] = {
+            'flat': (trap_mf, [0, 0, 0.0002+c3, 0.005+c3]),
+            'can': (trap_mf, [0.0002+c3, 0.005+c3, 0.12+c3, 0.15+c3]),
+            'probably': (trap_mf, [0.12+c3, 0.15+c3, 0.17+c3, 0.23+c3]),
+            'cannot': (trap_mf, [0.17+c3, 0.23+c3, 1, 1])
+        }
+
+    elif adj_type == 'scale':
+        # scale the sides of each MF about its top, which stays fixed so neighbouring MFs keep a consistent intersection:
+        #   triangles (a,b,c): a = b - ((b - a) * scalefactor), c = b + ((c - b) * scalefactor)
+        #   trapezoids (a,b,c,d): a = b - ((b - a) * scalefactor), d = c + ((d - c) * scalefactor)
+        for var, scale in [('input2', adj_vals[0]), ('input3', adj_vals[1]), ('input4', adj_vals[2])]:
+            for term, (mf, params) in combined_mfs[var].items():
+                if mf is tri_mf:
+                    a, b, _, d = calculate_trap_scale([params[0], params[1], params[1], params[2]], scale)
+                    mfs[var][term] = (tri_mf, [a, b, d])
+                else:
+                    mfs[var][term] = (trap_mf, calculate_trap_scale(params, scale))
+
+    elif adj_type == 'shape':
+        log.info("Running custom-defined MF shapes.")
+        # CUSTOM SHAPES DEFINED HERE
+        mfs['input2'] = {
+            'persists': (gbell_mf, [500, 5, 500]),
+            'breach': (gauss_mf, [1200, 150]),
+            'oblowout': (gauss_mf, [1700, 250]),
+            'blowout': (gbell_mf, [4200, 20, 6200])
+        }
+
+        mfs['input3'] = {
+            'can': (gbell_mf, [85, 8, 75]),
+            'probably': (gbell_mf, [10, 2, 170]),
+            'cannot': (gbell_mf, [4910, 750, 5090])
+        }
+
+        mfs['input4'] = {
+            'flat': (gbell_mf, [0.0025, 3, 0.0025]),
+            'can': (gbell_mf, [0.07, 3, 0.06]),
+            'probably': (gbell_mf, [0.035, 1.5, 0.165]),
+            'cannot': (gbell_mf, [0.38, 14, 0.585])
+        }
+
+    check_mf_order(mfs)
+
+    return mfs
 
 
 def calculate_trap_scale(abcd: list = None, scale_factor: float = 1.0):
@@ -450,7 +290,274 @@ def calculate_trap_scale(abcd: list = None, scale_factor: float = 1.0):
     return [a, b, c, d]
 
 
-def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_field: str, dam_count_field: str, max_drainage_area: float):
+def _extract_arrays(feature_values: dict, veg_fis_field: str):
+    """
+    Pull the combined FIS inputs out of the feature dictionary in a single pass
+    :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
+    :param veg_fis_field: Attribute containing the vegetation FIS result
+    :return: Arrays of reach IDs, artificial path (ReachCode 33600) flags, vegetation FIS, SP2, SPLow, slope, drainage area and reach length
+    """
+
+    feature_count = len(feature_values)
+    getter = itemgetter(veg_fis_field, 'iHyd_SP2', 'iHyd_SPLow', 'iGeo_Slope', 'iGeo_DA', 'iGeo_Len')
+    # only the artificial path flag is needed from ReachCode, so it is computed in the same pass rather than keeping the codes
+    rows = np.fromiter(((values['ReachCode'] == 33600,) + getter(values) for values in feature_values.values()), count=feature_count,
+                       dtype=[('artificial', np.bool_), ('veg', np.float64), ('sp2', np.float64), ('splow', np.float64), ('slope', np.float64), ('drain', np.float64),
+                              ('len', np.float64)])
+    reachid_array = np.fromiter(feature_values.keys(), np.int64, count=feature_count)
+
+    return reachid_array, rows['artificial'].copy(), rows['veg'].copy(), rows['sp2'].copy(), rows['splow'].copy(), rows['slope'].copy(), rows['drain'].copy(), rows['len'].copy()
+
+
+def combined_fis_capacity(inputs: dict, mfs: dict) -> np.ndarray:
+    """
+    Run the combined FIS and defuzzify the density for each feature. Features are processed in chunks
+    so the memberships and activations of a chunk stay in cache
+    :param inputs: Dictionary of input arrays keyed by FIS variable label
+    :param mfs: Dictionary of (function, parameters) MFs keyed by FIS variable label then term
+    :return: Array of dam capacity for each feature
+    """
+
+    feature_count = inputs['input1'].size
+    capacity_array = np.zeros(feature_count)
+    progbar = ProgressBar(feature_count, 50, "Combined FIS")
+    for start in range(0, feature_count, fis_chunk_size):
+        chunk = slice(start, start + fis_chunk_size)
+        activations = fis_term_activations({var: values[chunk] for var, values in inputs.items()}, mfs)
+        capacity = density_centroid(activations)
+
+        # Combined FIS result cannot be higher than limiting vegetation FIS result
+        np.minimum(capacity, inputs['input1'][chunk], out=capacity)
+
+        # re-classify reaches where only the density 'none' MF group fired (its centroid is not zero) to zero
+        capacity[activations[:, 1:].max(axis=1) < 1e-9] = 0.0
+        capacity_array[chunk] = capacity
+        progbar.update(min(start + fis_chunk_size, feature_count))
+    progbar.finish()
+
+    return capacity_array
+
+
+def fis_term_activations(inputs: dict, mfs: dict) -> np.ndarray:
+    """
+    Evaluate the FIS rules for all features at once using min (AND) / max (OR) inference
+    :param inputs: Dictionary of input arrays keyed by FIS variable label
+    :param mfs: Dictionary of (function, parameters) MFs keyed by FIS variable label then term
+    :return: Array (features x density terms) with the activation of each density term
+    """
+
+    # membership of every input in every term (terms x features), in combined_terms order. Piecewise
+    # linear inputs are evaluated for all their terms in one pass from a packed parameter table
+    memberships = {}
+    for var, terms in combined_terms.items():
+        params = trap_params([mfs[var][term] for term in terms])
+        if params is not None:
+            memberships[var] = trap_mf_table(inputs[var], params)
+        else:
+            memberships[var] = np.stack([mfs[var][term][0](inputs[var], *mfs[var][term][1]) for term in terms])
+    mu_ovc, mu_sp2, mu_splow, mu_slope = memberships['input1'], memberships['input2'], memberships['input3'], memberships['input4']
+    mu_slope = np.concatenate([mu_slope, 1.0 - mu_slope[3:4]])
+
+    # features where an input has no membership in any term the table rules use (no vegetation, or SPLow
+    # or slope beyond what dams can withstand) can only fire the single term 'none' rules, so skip the
+    # table rules for them
+    fires = np.ones(mu_ovc.shape[1], dtype=bool)
+    for mu, rule_terms in zip([mu_ovc, mu_sp2, mu_splow, mu_slope], combined_rule_terms.T):
+        fires &= mu[np.unique(rule_terms)].max(axis=0) > 0
+    Logger('Combined FIS').debug('{:,} of {:,} features can only fire the none rules'.format(fires.size - np.count_nonzero(fires), fires.size))
+
+    if fires.all():
+        return _rule_activations(mu_ovc, mu_sp2, mu_splow, mu_slope)
+
+    activations = np.zeros((mu_ovc.shape[1], len(density_terms)))
+    activations[:, 0] = np.fmax(np.fmax(mu_ovc[0], mu_splow[2]), mu_slope[3])
+    if fires.any():
+        activations[fires] = _rule_activations(mu_ovc[:, fires], mu_sp2[:, fires], mu_splow[:, fires], mu_slope[:, fires])
+
+    return activations
+
+
+def _rule_activations(mu_ovc: np.ndarray, mu_sp2: np.ndarray, mu_splow: np.ndarray, mu_slope: np.ndarray) -> np.ndarray:
+    """
+    Apply the single term and table rules to the input memberships
+    :param mu_ovc, mu_sp2, mu_splow, mu_slope: Memberships (terms x features), slope with 'not cannot' last
+    :return: Array (features x density terms) with the activation of each density term
+    """
+
+    if njit is not None:
+        return _rule_activations_kernel(mu_ovc, mu_sp2, mu_splow, mu_slope, combined_rule_terms, combined_rule_density, len(density_terms))
+
+    # single term rules: no vegetation, or SPLow or slope that dams cannot withstand, means no dams
+    activations = np.zeros((len(density_terms), mu_ovc.shape[1]))
+    activations[0] = np.fmax(np.fmax(mu_ovc[0], mu_splow[2]), mu_slope[3])
+
+    # table rules, grouped by the density term they produce and folded into that term's row in place.
+    # Memberships are terms x features so every rule works on contiguous rows with preallocated buffers
+    strength = np.empty(mu_ovc.shape[1])
+    slope_strength = np.empty(mu_ovc.shape[1])
+    for density_term, (ovc_term, sp2_term, splow_term, slope_term) in combined_rule_groups:
+        group_max = activations[density_term]
+        for i, j, k, m in zip(ovc_term, sp2_term, splow_term, slope_term):
+            np.fmin(mu_ovc[i], mu_sp2[j], out=strength)
+            np.fmin(mu_splow[k], mu_slope[m], out=slope_strength)
+            np.fmin(strength, slope_strength, out=strength)
+            np.fmax(group_max, strength, out=group_max)
+
+    return activations.T
+
+
+def _rule_activations_kernel(mu_ovc, mu_sp2, mu_splow, mu_slope, rule_terms, rule_density, density_count):
+    """
+    Same rule evaluation as _rule_activations, looping over features so numba can run them in parallel
+    and keep each feature's rule strengths in registers
+    :param mu_ovc, mu_sp2, mu_splow, mu_slope: Memberships (terms x features), slope with 'not cannot' last
+    :param rule_terms: Array (rules x 4) of the oVC, SP2, SPLow and slope term index of each table rule
+    :param rule_density: Density term index produced by each table rule
+    :param density_count: Number of density terms
+    :return: Array (features x density terms) with the activation of each density term
+    """
+
+    activations = np.zeros((mu_ovc.shape[1], density_count))
+    for n in prange(mu_ovc.shape[1]):
+        # single term rules: no vegetation, or SPLow or slope that dams cannot withstand, means no dams
+        activations[n, 0] = max(max(mu_ovc[0, n], mu_splow[2, n]), mu_slope[3, n])
+
+        for r in range(rule_terms.shape[0]):
+            strength = min(min(mu_ovc[rule_terms[r, 0], n], mu_sp2[rule_terms[r, 1], n]),
+                           min(mu_splow[rule_terms[r, 2], n], mu_slope[rule_terms[r, 3], n]))
+            if strength > activations[n, rule_density[r]]:
+                activations[n, rule_density[r]] = strength
+
+    return activations
+
+
+if njit is not None:
+    _rule_activations_kernel = njit(parallel=True, cache=True)(_rule_activations_kernel)
+
+
+# standard combined FIS membership functions as (function, parameters), keyed by FIS variable label and term
+combined_mfs = {
+    'input1': {
+        'none': (tri_mf, [0, 0, 0.1]),
+        'rare': (trap_mf, [0, 0.1, 0.5, 1.5]),
+        'occasional': (trap_mf, [0.5, 1.5, 4, 8]),
+        'frequent': (trap_mf, [4, 8, 12, 25]),
+        'pervasive': (trap_mf, [12, 25, 45, 45])
+    },
+    'input2': {
+        'persists': (trap_mf, [0, 0, 1000, 1200]),
+        'breach': (tri_mf, [1000, 1200, 1600]),
+        'oblowout': (tri_mf, [1200, 1600, 2400]),
+        'blowout': (trap_mf, [1600, 2400, 10000, 10000])
+    },
+    'input3': {
+        'can': (trap_mf, [0, 0, 150, 175]),
+        'probably': (trap_mf, [150, 175, 180, 190]),
+        'cannot': (trap_mf, [180, 190, 10000, 10000])
+    },
+    'input4': {
+        'flat': (trap_mf, [0, 0, 0.0002, 0.005]),
+        'can': (trap_mf, [0.0002, 0.005, 0.12, 0.15]),
+        'probably': (trap_mf, [0.12, 0.15, 0.17, 0.23]),
+        'cannot': (trap_mf, [0.17, 0.23, 1, 1])
+    },
+    'result': density_mfs
+}
+
+# terms of each combined FIS input in rule table order. '~cannot' (not cannot) is only used by the rule table
+combined_terms = {
+    'input1': density_terms,
+    'input2': ['persists', 'breach', 'oblowout', 'blowout'],
+    'input3': ['can', 'probably', 'cannot'],
+    'input4': ['flat', 'can', 'probably', 'cannot']
+}
+
+# combined FIS rule table: (oVC, SP2, SPLow, slope) terms -> density term
+# the single term rules (oVC none, SPLow cannot, slope cannot -> none) are applied in fis_term_activations
+combined_rules = {
+    ('rare', 'persists', 'can', '~cannot'): 'rare',
+    ('rare', 'persists', 'probably', '~cannot'): 'rare',
+    ('rare', 'breach', 'can', '~cannot'): 'rare',
+    ('rare', 'breach', 'probably', '~cannot'): 'rare',
+    ('rare', 'oblowout', 'can', '~cannot'): 'rare',
+    ('rare', 'oblowout', 'probably', '~cannot'): 'rare',
+    ('rare', 'blowout', 'can', '~cannot'): 'none',
+    ('rare', 'blowout', 'probably', '~cannot'): 'none',
+    ('occasional', 'persists', 'can', '~cannot'): 'occasional',
+    ('occasional', 'persists', 'probably', '~cannot'): 'occasional',
+    ('occasional', 'breach', 'can', '~cannot'): 'occasional',
+    ('occasional', 'breach', 'probably', '~cannot'): 'occasional',
+    ('occasional', 'oblowout', 'can', '~cannot'): 'occasional',
+    ('occasional', 'oblowout', 'probably', '~cannot'): 'rare',
+    ('occasional', 'blowout', 'can', '~cannot'): 'rare',
+    ('occasional', 'blowout', 'probably', '~cannot'): 'rare',
+    ('frequent', 'persists', 'can', 'flat'): 'occasional',
+    ('frequent', 'persists', 'can', 'can'): 'frequent',
+    ('frequent', 'persists', 'can', 'probably'): 'occasional',
+    ('frequent', 'persists', 'probably', 'flat'): 'occasional',
+    ('frequent', 'persists', 'probably', 'can'): 'frequent',
+    ('frequent', 'persists', 'probably', 'probably'): 'occasional',
+    ('frequent', 'breach', 'can', 'flat'): 'occasional',
+    ('frequent', 'breach', 'can', 'can'): 'frequent',
+    ('frequent', 'breach', 'can', 'probably'): 'occasional',
+    ('frequent', 'breach', 'probably', 'flat'): 'occasional',
+    ('frequent', 'breach', 'probably', 'can'): 'frequent',
+    ('frequent', 'breach', 'probably', 'probably'): 'occasional',
+    ('frequent', 'oblowout', 'can', 'flat'): 'occasional',
+    ('frequent', 'oblowout', 'can', 'can'): 'frequent',
+    ('frequent', 'oblowout', 'can', 'probably'): 'occasional',
+    ('frequent', 'oblowout', 'probably', 'flat'): 'rare',
+    ('frequent', 'oblowout', 'probably', 'can'): 'occasional',
+    ('frequent', 'oblowout', 'probably', 'probably'): 'rare',
+    ('frequent', 'blowout', 'can', 'flat'): 'rare',
+    ('frequent', 'blowout', 'can', 'can'): 'rare',
+    ('frequent', 'blowout', 'can', 'probably'): 'rare',
+    ('frequent', 'blowout', 'probably', 'flat'): 'rare',
+    ('frequent', 'blowout', 'probably', 'can'): 'rare',
+    ('frequent', 'blowout', 'probably', 'probably'): 'none',
+    ('pervasive', 'persists', 'can', 'flat'): 'frequent',
+    ('pervasive', 'persists', 'can', 'can'): 'pervasive',
+    ('pervasive', 'persists', 'can', 'probably'): 'occasional',
+    ('pervasive', 'persists', 'probably', 'flat'): 'frequent',
+    ('pervasive', 'persists', 'probably', 'can'): 'pervasive',
+    ('pervasive', 'persists', 'probably', 'probably'): 'frequent',
+    ('pervasive', 'breach', 'can', 'flat'): 'occasional',
+    ('pervasive', 'breach', 'can', 'can'): 'frequent',
+    ('pervasive', 'breach', 'can', 'probably'): 'occasional',
+    ('pervasive', 'breach', 'probably', 'flat'): 'occasional',
+    ('pervasive', 'breach', 'probably', 'can'): 'frequent',
+    ('pervasive', 'breach', 'probably', 'probably'): 'occasional',
+    ('pervasive', 'oblowout', 'can', 'flat'): 'occasional',
+    ('pervasive', 'oblowout', 'can', 'can'): 'frequent',
+    ('pervasive', 'oblowout', 'can', 'probably'): 'occasional',
+    ('pervasive', 'oblowout', 'probably', 'flat'): 'occasional',
+    ('pervasive', 'oblowout', 'probably', 'can'): 'occasional',
+    ('pervasive', 'oblowout', 'probably', 'probably'): 'rare',
+    ('pervasive', 'blowout', 'can', 'flat'): 'rare',
+    ('pervasive', 'blowout', 'can', 'can'): 'occasional',
+    ('pervasive', 'blowout', 'can', 'probably'): 'rare',
+    ('pervasive', 'blowout', 'probably', 'flat'): 'rare',
+    ('pervasive', 'blowout', 'probably', 'can'): 'rare',
+    ('pervasive', 'blowout', 'probably', 'probably'): 'rare',
+}
+
+# the rules as a (oVC x SP2 x SPLow x slope) lookup of density term index, -1 where there is no rule
+combined_rule_table = np.full((5, 4, 3, 5), -1, dtype=np.int8)
+for (ovc_term, sp2_term, splow_term, slope_term), density_term in combined_rules.items():
+    combined_rule_table[density_terms.index(ovc_term), combined_terms['input2'].index(sp2_term), combined_terms['input3'].index(splow_term),
+                        (combined_terms['input4'] + ['~cannot']).index(slope_term)] = density_terms.index(density_term)
+
+# the table rules as (rules x 4) term indices and their density term index for the numba kernel, and
+# grouped by density term, as (density term index, (oVC, SP2, SPLow, slope term indices)), for NumPy
+combined_rule_cells = np.nonzero(combined_rule_table >= 0)
+combined_rule_terms = np.column_stack(combined_rule_cells).astype(np.int64)
+combined_rule_density = combined_rule_table[combined_rule_cells].astype(np.int64)
+combined_rule_groups = [(density_term, tuple(cell[combined_rule_table[combined_rule_cells] == density_term] for cell in combined_rule_cells))
+                        for density_term in np.unique(combined_rule_table[combined_rule_cells])]
+
+
+def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_field: str, dam_count_field: str, max_drainage_area: float,
+                           mfs: dict = None):
     """
     Calculate dam capacity and density using combined FIS
     :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
@@ -458,6 +565,7 @@ def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_fi
     :param com_capacity_field: Attribute used to store the capacity result in feature_values
     :param com_density_field: Attribute used to store the capacity results in feature_values
     :param max_drainage_area: Reaches with drainage area greater than this threshold will have zero capacity
+    :param mfs: Adjusted MFs from build_combined_mfs, or None for the standard combined FIS
     :return: Insert the dam capacity and density values to the feature_values dictionary
     """
 
@@ -467,204 +575,39 @@ def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_fi
     if not max_drainage_area:
         log.warning('Missing max drainage area. Calculating combined FIS without max drainage threshold.')
 
+    if mfs is None:
+        mfs = combined_mfs
+
     # get arrays for fields of interest
-    feature_count = len(feature_values)
-    reachid_array = np.zeros(feature_count, np.int64)
-    reachcode_array = np.zeros(feature_count, np.int64)
-    veg_array = np.zeros(feature_count, np.float64)
-    hydq2_array = np.zeros(feature_count, np.float64)
-    hydlow_array = np.zeros(feature_count, np.float64)
-    slope_array = np.zeros(feature_count, np.float64)
-    drain_array = np.zeros(feature_count, np.float64)
-
-    counter = 0
-    for reach_id, values in feature_values.items():
-        reachid_array[counter] = reach_id
-        reachcode_array[counter] = values['ReachCode']
-        veg_array[counter] = values[veg_fis_field]
-        hydlow_array[counter] = values['iHyd_SPLow']
-        hydq2_array[counter] = values['iHyd_SP2']
-        slope_array[counter] = values['iGeo_Slope']
-        drain_array[counter] = values['iGeo_DA']
-        counter += 1
+    reachid_array, artificial_array, veg_array, hydq2_array, hydlow_array, slope_array, drain_array, len_array = _extract_arrays(feature_values, veg_fis_field)
 
     # Adjust inputs to be within FIS membership range
-    veg_array[veg_array < 0] = 0
-    veg_array[veg_array > 45] = 45
-
-    hydq2_array[hydq2_array < 0] = 0.0001
-    hydq2_array[hydq2_array > 10000] = 10000
-
-    hydlow_array[hydlow_array < 0] = 0.0001
-    hydlow_array[hydlow_array > 10000] = 10000
-    slope_array[slope_array > 1] = 1
-
-    # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
-    ovc = ctrl.Antecedent(np.arange(0, 45, 0.01), 'input1')
-    sp2 = ctrl.Antecedent(np.arange(0, 10000, 1), 'input2')
-    splow = ctrl.Antecedent(np.arange(0, 10000, 1), 'input3')
-    slope = ctrl.Antecedent(np.arange(0, 1, 0.0001), 'input4')
-    density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')
-
-    # build membership functions for each antecedent and consequent object
-    ovc['none'] = fuzz.trimf(ovc.universe, [0, 0, 0.1])
-    ovc['rare'] = fuzz.trapmf(ovc.universe, [0, 0.1, 0.5, 1.5])
-    ovc['occasional'] = fuzz.trapmf(ovc.universe, [0.5, 1.5, 4, 8])
-    ovc['frequent'] = fuzz.trapmf(ovc.universe, [4, 8, 12, 25])
-    ovc['pervasive'] = fuzz.trapmf(ovc.universe, [12, 25, 45, 45])
-
-    sp2['persists'] = fuzz.trapmf(sp2.universe, [0, 0, 1000, 1200])
-    sp2['breach'] = fuzz.trimf(sp2.universe, [1000, 1200, 1600])
-    sp2['oblowout'] = fuzz.trimf(sp2.universe, [1200, 1600, 2400])
-    sp2['blowout'] = fuzz.trapmf(sp2.universe, [1600, 2400, 10000, 10000])
-
-    splow['can'] = fuzz.trapmf(splow.universe, [0, 0, 150, 175])
-    splow['probably'] = fuzz.trapmf(splow.universe, [150, 175, 180, 190])
-    splow['cannot'] = fuzz.trapmf(splow.universe, [180, 190, 10000, 10000])
-
-    slope['flat'] = fuzz.trapmf(slope.universe, [0, 0, 0.0002, 0.005])
-    slope['can'] = fuzz.trapmf(slope.universe, [0.0002, 0.005, 0.12, 0.15])
-    slope['probably'] = fuzz.trapmf(slope.universe, [0.12, 0.15, 0.17, 0.23])
-    slope['cannot'] = fuzz.trapmf(slope.universe, [0.17, 0.23, 1, 1])
-
-    density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
-    density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
-    density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
-    density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
-    density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
-
-    # build fis rule table
-    log.info('Building FIS rule table')
-    comb_ctrl = ctrl.ControlSystem([
-        ctrl.Rule(ovc['none'], density['none']),
-        ctrl.Rule(splow['cannot'], density['none']),
-        ctrl.Rule(slope['cannot'], density['none']),
-        ctrl.Rule(ovc['rare'] & sp2['persists'] & splow['can'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['persists'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['breach'] & splow['can'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['breach'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['oblowout'] & splow['can'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['oblowout'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['rare'] & sp2['blowout'] & splow['can'] & ~slope['cannot'], density['none']),
-        ctrl.Rule(ovc['rare'] & sp2['blowout'] & splow['probably'] & ~slope['cannot'], density['none']),
-        ctrl.Rule(ovc['occasional'] & sp2['persists'] & splow['can'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['persists'] & splow['probably'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['breach'] & splow['can'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['breach'] & splow['probably'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['oblowout'] & splow['can'] & ~slope['cannot'], density['occasional']),
-        ctrl.Rule(ovc['occasional'] & sp2['oblowout'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['occasional'] & sp2['blowout'] & splow['can'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['occasional'] & sp2['blowout'] & splow['probably'] & ~slope['cannot'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['can'], density['occasional']),
-        ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['probably'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['can'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['probably'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['can'], density['rare']),
-        ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['none']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['flat'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['can'], density['pervasive']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['flat'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['can'], density['pervasive']),
-        ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['probably'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['can'], density['frequent']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['probably'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['flat'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['can'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['probably'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['can'], density['occasional']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['probably'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['flat'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['can'], density['rare']),
-        ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['rare'])
-    ])
-
-    comb_fis = ctrl.ControlSystemSimulation(comb_ctrl)
-
-    # calculate defuzzified centroid value for density 'none' MF group
-    # this will be used to re-classify output values that fall in this group
-    # important: will need to update the array (x) and MF values (mfx) if the
-    # density 'none' values are changed in the model
-    x_vals = np.arange(0, 45, 0.01)
-    mfx = fuzz.trimf(x_vals, [0, 0, 0.1])
-    defuzz_centroid = round(fuzz.defuzz(x_vals, mfx, 'centroid'), 6)
-
-    progbar = ProgressBar(len(reachid_array), 50, "Combined FIS")
-    counter = 0
-
-    for i, reach_id in enumerate(reachid_array):
-
-        capacity = 0.0
-        # Only compute FIS if the reach has less than user-defined max drainage area.
-        # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
-        if not max_drainage_area or drain_array[i] < max_drainage_area:
-
-            comb_fis.input['input1'] = veg_array[i]
-            comb_fis.input['input2'] = hydq2_array[i]
-            comb_fis.input['input3'] = hydlow_array[i]
-            comb_fis.input['input4'] = slope_array[i]
-            comb_fis.compute()
-            capacity = comb_fis.output['result']
-
-            # Combined FIS result cannot be higher than limiting vegetation FIS result
-            if capacity > veg_array[i]:
-                capacity = veg_array[i]
-
-            if round(capacity, 6) == defuzz_centroid:
-                capacity = 0.0
-
-        elif drain_array[i] >= max_drainage_area and reachcode_array[i] == 33600:
-
-            comb_fis.input['input1'] = veg_array[i]
-            comb_fis.input['input2'] = hydq2_array[i]
-            comb_fis.input['input3'] = hydlow_array[i]
-            comb_fis.input['input4'] = slope_array[i]
-            comb_fis.compute()
-            capacity = comb_fis.output['result']
-
-            # Combined FIS result cannot be higher than limiting vegetation FIS result
-            if capacity > veg_array[i]:
-                capacity = veg_array[i]
-
-            if round(capacity, 6) == defuzz_centroid:
-                capacity = 0.0
-
-        count = capacity * (feature_values[reach_id]['iGeo_Len'] / 1000.0)
-        count = 1.0 if 0 < count < 1 else count
-
-        feature_values[reach_id][capacity_field] = round(capacity, 2)
-        feature_values[reach_id][dam_count_field] = round(count, 2)
-
-        counter += 1
-        progbar.update(counter)
+    # slope is also clamped at 0 as the skfuzzy universe did, so negative slopes still read as flat
+    np.clip(veg_array, 0, 45, out=veg_array)
+    np.clip(hydq2_array, 0.0001, 10000, out=hydq2_array)
+    np.clip(hydlow_array, 0.0001, 10000, out=hydlow_array)
+    np.clip(slope_array, 0, 1, out=slope_array)
+
+    # Only compute FIS if the reach has less than user-defined max drainage area (or is an artificial path).
+    # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
+    fis_array = np.zeros(reachid_array.size)
+    if max_drainage_area:
+        compute = (drain_array < max_drainage_area) | artificial_array
+    else:
+        compute = np.ones(reachid_array.size, dtype=bool)
+
+    # run the fuzzy inference system on those reaches and defuzzify output
+    fis_array[compute] = combined_fis_capacity({'input1': veg_array[compute], 'input2': hydq2_array[compute], 'input3': hydlow_array[compute], 'input4': slope_array[compute]}, mfs)
+
+    # dam count is capacity (dams/km) times reach length, with at least one dam on any reach with capacity
+    count_array = fis_array * len_array / 1000.0
+    count_array[(count_array > 0) & (count_array < 1)] = 1.0
+
+    for reach_id, capacity, count in zip(reachid_array.tolist(), np.round(fis_array, 2).tolist(), np.round(count_array, 2).tolist()):
+        values = feature_values[reach_id]
+        values[capacity_field] = capacity
+        values[dam_count_field] = count
 
-    progbar.finish()
     log.info('Done')
 
 
@@ -0,0 +1,269 @@
+"""
+Membership functions and centroid defuzzification shared by the custom vegetation and combined FIS scripts.
+Each MF is held as (function, parameters) and evaluated directly on the feature inputs, matching the
+scikit-fuzzy MFs used by the original sqlBRAT FIS.
+Both scripts import this as the top-level module fis_helpers, so copy it along with either script.
+"""
+
+import numpy as np
+
+# numba is optional. Without it the MF table and density centroid fall back to the pure NumPy versions
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+
+# density (output) terms in order along the capacity axis
+density_terms = ['none', 'rare', 'occasional', 'frequent', 'pervasive']
+
+
+def tri_mf(x: np.ndarray, a: float, b: float, c: float) -> np.ndarray:
+    """
+    Triangular membership function, equivalent to fuzz.trimf
+    :param x: Array of values to evaluate
+    :param a, b, c: Left foot, peak and right foot of the triangle
+    :return: Membership of each value
+    """
+    return trap_mf(x, a, b, b, c)
+
+
+def trap_mf(x: np.ndarray, a: float, b: float, c: float, d: float) -> np.ndarray:
+    """
+    Trapezoidal membership function, equivalent to fuzz.trapmf. Vertical edges (a == b or c == d) are allowed
+    :param x: Array of values to evaluate
+    :param a, b, c, d: Left foot, left shoulder, right shoulder and right foot of the trapezoid
+    :return: Membership of each value
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.ones_like(x)
+    if a < b:
+        np.minimum(y, (x - a) / (b - a), out=y)
+    else:
+        y[x < a] = 0.0
+    if c < d:
+        np.minimum(y, (d - x) / (d - c), out=y)
+    else:
+        y[x > d] = 0.0
+    return np.clip(y, 0.0, 1.0, out=y)
+
+
+def trap_params(mfs: list) -> np.ndarray:
+    """
+    Pack triangular and trapezoidal MFs into one table of trapezoid parameters, with each triangle's
+    peak repeated as both shoulders
+    :param mfs: List of (function, parameters) MFs
+    :return: Array (terms x 4) of a, b, c, d or None if any MF is not triangular or trapezoidal
+    """
+    params = np.empty((len(mfs), 4))
+    for row, (mf, mf_params) in zip(params, mfs):
+        if mf is tri_mf:
+            row[:] = mf_params[0], mf_params[1], mf_params[1], mf_params[2]
+        elif mf is trap_mf:
+            row[:] = mf_params
+        else:
+            return None
+    return params
+
+
+def check_mf_order(mfs: dict):
+    """
+    Check that the parameters of every triangular and trapezoidal MF are in order (a <= b <= c <= d),
+    as fuzz.trimf/fuzz.trapmf required. trap_mf does not check, and would evaluate out of order parameters to nonsense
+    :param mfs: Dictionary of (function, parameters) MFs keyed by FIS variable label then term
+    :return: None. Raises ValueError naming the first MF that is out of order
+    """
+    for var, terms in mfs.items():
+        for term, (mf, params) in terms.items():
+            if (mf is tri_mf or mf is trap_mf) and any(low > high for low, high in zip(params[:-1], params[1:])):
+                raise ValueError(f"Invalid {var} '{term}' MF parameters: {params}. Must be in non-decreasing order (check the adjustment values).")
+
+
+def trap_mf_table(x: np.ndarray, params: np.ndarray) -> np.ndarray:
+    """
+    Evaluate a table of trapezoidal MFs (see trap_params) on the same values, equivalent to calling trap_mf for each row
+    :param x: Array of values to evaluate
+    :param params: Array (terms x 4) of left foot, left shoulder, right shoulder and right foot
+    :return: Array (terms x values) of memberships
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if njit is not None:
+        return _trap_mf_table_kernel(np.ascontiguousarray(x), params)
+
+    a, b, c, d = (params[:, i:i + 1] for i in range(4))
+    # vertical edges (a == b or c == d) are a step at the edge instead of a slope
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rise = np.where(a < b, (x - a) / (b - a), np.where(x < a, 0.0, 1.0))
+        fall = np.where(c < d, (d - x) / (d - c), np.where(x > d, 0.0, 1.0))
+    np.minimum(rise, fall, out=rise)
+    return np.clip(rise, 0.0, 1.0, out=rise)
+
+
+def _trap_mf_table_kernel(x, params):
+    """
+    Same evaluation as trap_mf_table, looping over values so numba can run them in parallel
+    :param x: Array of values to evaluate
+    :param params: Array (terms x 4) of left foot, left shoulder, right shoulder and right foot
+    :return: Array (terms x values) of memberships
+    """
+
+    memberships = np.empty((params.shape[0], x.shape[0]))
+    for n in prange(x.shape[0]):
+        for t in range(params.shape[0]):
+            a, b, c, d = params[t, 0], params[t, 1], params[t, 2], params[t, 3]
+            if a < b:
+                rise = (x[n] - a) / (b - a)
+            else:
+                rise = 0.0 if x[n] < a else 1.0
+            if c < d:
+                fall = (d - x[n]) / (d - c)
+            else:
+                fall = 0.0 if x[n] > d else 1.0
+            memberships[t, n] = max(0.0, min(1.0, min(rise, fall)))
+
+    return memberships
+
+
+if njit is not None:
+    _trap_mf_table_kernel = njit(parallel=True, cache=True)(_trap_mf_table_kernel)
+
+
+def gbell_mf(x: np.ndarray, a: float, b: float, c: float) -> np.ndarray:
+    """
+    Generalized bell membership function, equivalent to fuzz.gbellmf
+    :param x: Array of values to evaluate
+    :param a: Width, b: slope, c: centre of the bell
+    :return: Membership of each value
+    """
+    # steep bells overflow to inf far from the centre, which correctly gives zero membership
+    with np.errstate(over='ignore'):
+        return 1.0 / (1.0 + np.abs((np.asarray(x, dtype=np.float64) - c) / a) ** (2 * b))
+
+
+def gauss_mf(x: np.ndarray, mean: float, sigma: float) -> np.ndarray:
+    """
+    Gaussian membership function, equivalent to fuzz.gaussmf
+    :param x: Array of values to evaluate
+    :param mean: Centre of the curve, sigma: standard deviation
+    :return: Membership of each value
+    """
+    return np.exp(-((np.asarray(x, dtype=np.float64) - mean) ** 2) / (2.0 * sigma ** 2))
+
+
+# standard density (output) MFs as (function, parameters), keyed by term. Used by both the vegetation and combined FIS
+density_mfs = {
+    'none': (tri_mf, [0, 0, 0.1]),
+    'rare': (trap_mf, [0, 0.1, 0.5, 1.5]),
+    'occasional': (trap_mf, [0.5, 1.5, 4, 8]),
+    'frequent': (trap_mf, [4, 8, 12, 25]),
+    'pervasive': (trap_mf, [12, 25, 45, 45])
+}
+
+# the density MFs form a trapezoidal partition: each term's falling edge is the next term's rising edge.
+# Each term is fully 1 between its plateau start and end, and term k overlaps term k+1 between
+# density_plateau_end[k] and density_plateau_start[k + 1]. The first and last terms have no outer edge.
+# density_centroid relies on this layout, so check it rather than let the centroid silently stop matching the MFs
+density_params = trap_params([density_mfs[term] for term in density_terms])
+if not (np.array_equal(density_params[:-1, 2:], density_params[1:, :2]) and density_params[0, 0] == density_params[0, 1]
+        and density_params[-1, 2] == density_params[-1, 3]):
+    raise ValueError('The density MFs must form a trapezoidal partition: {}'.format(density_params.tolist()))
+density_plateau_start = np.ascontiguousarray(density_params[:, 1])
+density_plateau_end = np.ascontiguousarray(density_params[:, 2])
+
+
+def density_centroid(activations: np.ndarray) -> np.ndarray:
+    """
+    Centroid defuzzification of the density output, in closed form.
+    The aggregated output is the max of the density MFs, each clipped at its activation. On a term's
+    plateau this is flat. On an overlap it is piecewise linear, with kinks only where an edge meets a
+    clip height or the two edges cross, so it can be integrated exactly from a handful of breakpoints
+    instead of sampling the 4500 point output universe for every feature.
+    :param activations: Array (features x density terms) with the activation of each density term
+    :return: Array of defuzzified density values
+    """
+
+    if njit is not None:
+        return _density_centroid_kernel(np.ascontiguousarray(activations, dtype=np.float64), density_plateau_start, density_plateau_end)
+
+    # plateaus: each term on its own, flat at its activation
+    widths = density_plateau_end - density_plateau_start
+    area = activations @ widths
+    moment = activations @ (widths * (density_plateau_start + density_plateau_end) / 2)
+
+    # overlaps: with t running 0 to 1 across the overlap the output is max(min(left, 1 - t), min(right, t))
+    for k in range(len(density_terms) - 1):
+        left = activations[:, k]
+        right = activations[:, k + 1]
+        zeros = np.zeros_like(left)
+        t = np.sort([zeros, zeros + 1, zeros + 0.5, left, 1 - left, right, 1 - right], axis=0)
+        h = np.fmax(np.fmin(left, 1 - t), np.fmin(right, t))
+        dt = np.diff(t, axis=0)
+        t_area = (dt * (h[:-1] + h[1:]) / 2).sum(axis=0)
+        t_moment = (dt * (t[:-1] * (2 * h[:-1] + h[1:]) + t[1:] * (h[:-1] + 2 * h[1:])) / 6).sum(axis=0)
+
+        start = density_plateau_end[k]
+        width = density_plateau_start[k + 1] - start
+        area += width * t_area
+        moment += width * (start * t_area + width * t_moment)
+
+    return np.divide(moment, area, out=np.zeros_like(area), where=area > 0)
+
+
+def _density_centroid_kernel(activations, plateau_start, plateau_end):
+    """
+    Same closed form centroid as density_centroid, looping over features so numba can run them in parallel
+    without the (breakpoints x features) temporaries
+    :param activations: Array (features x density terms) with the activation of each density term
+    :param plateau_start: Start of each density term's plateau
+    :param plateau_end: End of each density term's plateau
+    :return: Array of defuzzified density values
+    """
+
+    terms = plateau_start.shape[0]
+    result = np.zeros(activations.shape[0])
+    for i in prange(activations.shape[0]):
+        area = 0.0
+        moment = 0.0
+        for k in range(terms):
+            width = plateau_end[k] - plateau_start[k]
+            area += activations[i, k] * width
+            moment += activations[i, k] * width * (plateau_start[k] + plateau_end[k]) / 2
+
+        t = np.empty(7)
+        for k in range(terms - 1):
+            left = activations[i, k]
+            right = activations[i, k + 1]
+            t[0], t[1], t[2], t[3], t[4], t[5], t[6] = 0.0, 1.0, 0.5, left, 1 - left, right, 1 - right
+            for j in range(1, 7):
+                # insertion sort, cheaper than a general sort for seven values
+                value = t[j]
+                pos = j - 1
+                while pos >= 0 and t[pos] > value:
+                    t[pos + 1] = t[pos]
+                    pos -= 1
+                t[pos + 1] = value
+
+            t_area = 0.0
+            t_moment = 0.0
+            h0 = max(min(left, 1 - t[0]), min(right, t[0]))
+            for j in range(1, 7):
+                h1 = max(min(left, 1 - t[j]), min(right, t[j]))
+                dt = t[j] - t[j - 1]
+                t_area += dt * (h0 + h1) / 2
+                t_moment += dt * (t[j - 1] * (2 * h0 + h1) + t[j] * (h0 + 2 * h1)) / 6
+                h0 = h1
+
+            start = plateau_end[k]
+            width = plateau_start[k + 1] - start
+            area += width * t_area
+            moment += width * (start * t_area + width * t_moment)
+
+        if area > 0:
+            result[i] = moment / area
+
+    return result
+
+
+if njit is not None:
+    _density_centroid_kernel = njit(parallel=True, cache=True)(_density_centroid_kernel)
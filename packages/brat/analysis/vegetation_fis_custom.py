@@ -1,6 +1,8 @@
 """
 An alternative to the original vegetation_fis.py, in which the FIS can be modified for sensitivity analysis.
 This script is meant to be imported into brat.py and called in place of vegetation_fis.py.
+It imports its MFs and defuzzification from fis_helpers.py, which must ship alongside it and be importable
+as a top-level module (i.e. in the same directory, or on sys.path), wherever this script is placed.
 A similar version is provided for the combined FIS.
 
 Much of the code is copied from the original vegetation_fis.py, credits:
@@ -20,13 +22,13 @@ import os
 import sys
 import argparse
 import traceback
+from functools import lru_cache
+from operator import itemgetter
 import numpy as np
-import skfuzzy as fuzz
-import matplotlib.pyplot as plt
-from skfuzzy import control as ctrl
-from rscommons import Logger, ProgressBar, dotenv
+from rscommons import Logger, dotenv
 from rscommons.database import load_attributes, load_dgo_attributes
 from rscommons.database import write_db_attributes, write_db_dgo_attributes
+from fis_helpers import density_terms, density_mfs, density_centroid, tri_mf, trap_mf, gbell_mf, gauss_mf, trap_params, trap_mf_table, check_mf_order
 
 
 adjustment_types = ['scale', 'shape']
@@ -35,9 +37,67 @@ adjustment_types = ['scale', 'shape']
     # shape: must be adjusted manually within this script by changing the MFs in calculate_vegetation_fis_custom()
 '''
 
+# vegetation FIS input terms in rule table order. Riparian (input1) and streamside (input2) use the same terms
+vegetation_terms = ['unsuitable', 'barely', 'moderately', 'suitable', 'preferred']
+
+# largest riparian and streamside input the FIS evaluates, the last point of the original 0-4 universe (0.01 step)
+vegetation_input_max = 3.99
+
+# standard vegetation FIS membership functions as (function, parameters), keyed by FIS variable label and term
+vegetation_mfs = {
+    'input1': {
+        'unsuitable': (trap_mf, [0, 0, 0.1, 1]),
+        'barely': (tri_mf, [0.1, 1, 2]),
+        'moderately': (tri_mf, [1, 2, 3]),
+        'suitable': (tri_mf, [2, 3, 4]),
+        'preferred': (tri_mf, [3, 4, 4])
+    },
+    'input2': {
+        'unsuitable': (trap_mf, [0, 0, 0.1, 1]),
+        'barely': (tri_mf, [0.1, 1, 2]),
+        'moderately': (tri_mf, [1, 2, 3]),
+        'suitable': (tri_mf, [2, 3, 4]),
+        'preferred': (tri_mf, [3, 4, 4])
+    }
+}
+
+# vegetation FIS rule table: (riparian, streamside) terms -> density term
+vegetation_rules = {
+    ('unsuitable', 'unsuitable'): 'none',
+    ('barely', 'unsuitable'): 'rare',
+    ('moderately', 'unsuitable'): 'rare',
+    ('suitable', 'unsuitable'): 'occasional',
+    ('preferred', 'unsuitable'): 'occasional',
+    ('unsuitable', 'barely'): 'rare',
+    ('barely', 'barely'): 'rare',  # matBRAT has consequnt as 'occasional'
+    ('moderately', 'barely'): 'occasional',
+    ('suitable', 'barely'): 'occasional',
+    ('preferred', 'barely'): 'occasional',
+    ('unsuitable', 'moderately'): 'rare',
+    ('barely', 'moderately'): 'occasional',
+    ('moderately', 'moderately'): 'occasional',
+    ('suitable', 'moderately'): 'frequent',
+    ('preferred', 'moderately'): 'frequent',
+    ('unsuitable', 'suitable'): 'occasional',
+    ('barely', 'suitable'): 'occasional',
+    ('moderately', 'suitable'): 'frequent',
+    ('suitable', 'suitable'): 'frequent',
+    ('preferred', 'suitable'): 'pervasive',
+    ('unsuitable', 'preferred'): 'occasional',
+    ('barely', 'preferred'): 'frequent',
+    ('moderately', 'preferred'): 'pervasive',
+    ('suitable', 'preferred'): 'pervasive',
+    ('preferred', 'preferred'): 'pervasive'
+}
+
+# the rules as a (riparian x streamside) lookup of density term index
+vegetation_rule_table = np.zeros((len(vegetation_terms), len(vegetation_terms)), dtype=np.int8)
+for (riparian_term, streamside_term), density_term in vegetation_rules.items():
+    vegetation_rule_table[vegetation_terms.index(riparian_term), vegetation_terms.index(streamside_term)] = density_terms.index(density_term)
+
 
 def vegetation_fis(database: str, label: str, veg_type: str, dgo: bool = None, 
-                   adjustment_type: str = None, adjustment_value: float = 1.0):
+                   adjustment_type: str = None, adjustment_value: float = 1.0, plot_mfs: bool = False):
     """Calculate vegetation suitability for each reach in a BRAT
     SQLite database
 
@@ -47,8 +107,11 @@ def vegetation_fis(database: str, label: str, veg_type: str, dgo: bool = None,
         veg_type {str} -- Prefix either 'EX' for existing or 'HPE' for historic
         adjustment_type {str} -- Type of adjustment to apply ('scale' or 'shape')
         adjustment_value {float} -- Value for the adjustment (e.g., scaling factor)
+        plot_mfs {bool} -- Show plots of the adjusted MFs (off by default so sweeps don't stop on every run)
     """
 
+    log = Logger('Vegetation FIS')
+
     # handle adjustments
     if adjustment_type:
         if adjustment_type not in adjustment_types:
@@ -59,28 +122,22 @@ def vegetation_fis(database: str, label: str, veg_type: str, dgo: bool = None,
             log.warning("Shape adjustments must be done manually in the code. No automatic adjustments applied.")
             adjustment_value = None
 
-    log = Logger('Vegetation FIS')
     log.info('Processing {} vegetation'.format(label))
     log.info('Adjustment type: {}, value: {}'.format(adjustment_type, adjustment_value))
 
     streamside_field = 'iVeg_30{}'.format(veg_type)
     riparian_field = 'iVeg100{}'.format(veg_type)
     out_field = 'oVC_{}'.format(veg_type)
+    where_clause = '({} IS NOT NULL) AND ({} IS NOT NULL)'.format(streamside_field, riparian_field)
 
-    if not dgo:
-        feature_values = load_attributes(database, [streamside_field, riparian_field], '({} IS NOT NULL) AND ({} IS NOT NULL)'.format(streamside_field, riparian_field))
-        if adjustment_type:
-            calculate_vegetation_fis_custom(feature_values, streamside_field, riparian_field, out_field, adjustment_type, adjustment_value)
-        else:
-            calculate_vegegtation_fis(feature_values, streamside_field, riparian_field, out_field)
-        write_db_attributes(database, feature_values, [out_field])
+    load_features = load_dgo_attributes if dgo else load_attributes
+    feature_values = load_features(database, [streamside_field, riparian_field], where_clause)
+    if adjustment_type:
+        calculate_vegetation_fis_custom(feature_values, streamside_field, riparian_field, out_field, adjustment_type, adjustment_value, plot_mfs)
     else:
-        feature_values = load_dgo_attributes(database, [streamside_field, riparian_field], '({} IS NOT NULL) AND ({} IS NOT NULL)'.format(streamside_field, riparian_field))
-        if adjustment_type:
-            calculate_vegetation_fis_custom(feature_values, streamside_field, riparian_field, out_field, adjustment_type, adjustment_value)
-        else:
-            calculate_vegegtation_fis(feature_values, streamside_field, riparian_field, out_field)
-        write_db_dgo_attributes(database, feature_values, [out_field])
+        calculate_vegegtation_fis(feature_values, streamside_field, riparian_field, out_field)
+    write_attributes = write_db_dgo_attributes if dgo else write_db_attributes
+    write_attributes(database, feature_values, [out_field], batch_size=10000)
 
     log.info('Process completed successfully.')
 
@@ -88,7 +145,7 @@ def vegetation_fis(database: str, label: str, veg_type: str, dgo: bool = None,
 
 # custom Veg FIS function that allows for sensitivity analysis adjustments
 def calculate_vegetation_fis_custom(feature_values: dict, streamside_field: str, riparian_field: str, out_field: str,
-                                    adj_type: str, adj_val: float):
+                                    adj_type: str, adj_val: float, plot_mfs: bool = False):
     """
     Adjustable beaver dam capacity vegetation FIS
     :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
@@ -96,41 +153,75 @@ def calculate_vegetation_fis_custom(feature_values: dict, streamside_field: str,
     :param riparian_field: Name of the riparian vegetation attribute
     :param adj_type: Type of adjustment to apply ('scale' or 'shape')
     :param adj_val: Value for the adjustment (scaling factor)
+    :param plot_mfs: Show plots of the adjusted MFs
     """
 
-    log = Logger('Vegetation FIS')
+    # build membership functions for each antecedent --- apply adjustments here
+    # the MFs only depend on the adjustment so they are cached across runs
+    mfs = build_vegetation_mfs(adj_type, adj_val)
 
-    feature_count = len(feature_values)
-    reachid_array = np.zeros(feature_count, np.int64)
-    riparian_array = np.zeros(feature_count, np.float64)
-    streamside_array = np.zeros(feature_count, np.float64)
+    calculate_vegegtation_fis(feature_values, streamside_field, riparian_field, out_field, mfs)
 
-    counter = 0
-    for reach_id, values in feature_values.items():
-        reachid_array[counter] = reach_id
-        riparian_array[counter] = values[riparian_field]
-        streamside_array[counter] = values[streamside_field]
-        counter += 1
+    if plot_mfs:
+        Logger('Vegetation FIS').info('Visualizing Adjusted MFs...')
+        plot_vegetation_mfs(mfs)
+
+
+def plot_vegetation_mfs(mfs: dict):
+    """
+    Show plots of the vegetation FIS MFs
+    :param mfs: Dictionary of (function, parameters) MFs keyed by FIS variable label then term
+    :return: None
+    """
+
+    import matplotlib.pyplot as plt
+
+    veg_universe = np.arange(0, 4, 0.01)
+    density_universe = np.arange(0, 45, 0.01)
+
+    # Riparian
+    for (label, (mf, params)), color in zip(mfs['input1'].items(), ['r', 'orange', 'y', 'g', 'b']):
+        plt.plot(veg_universe, mf(veg_universe, *params), color=color, linewidth=1.5, label=label.capitalize())
+    plt.xlabel('Riparian (100m) Suitability')
+    plt.ylabel('Membership')
+    plt.legend(loc='upper right')
+    plt.tight_layout()
+    plt.show()
+
+    # Streamside
+    for (label, (mf, params)), color in zip(mfs['input2'].items(), ['r', 'orange', 'y', 'g', 'b']):
+        plt.plot(veg_universe, mf(veg_universe, *params), color=color, linewidth=1.5, label=label.capitalize())
+    plt.xlabel('Streamside (30m) Suitability')
+    plt.ylabel('Membership')
+    plt.legend(loc='upper right')
+    plt.tight_layout()
+    plt.show()
+
+    # Density
+    fig, axs = plt.subplots(1, 1, figsize=(12, 4))
+    for (label, (mf, params)), color in zip(density_mfs.items(), ['r', 'orange', 'y', 'g', 'b']):
+        axs.plot(density_universe, mf(density_universe, *params), color=color, linewidth=1.5, label=label.capitalize())
+    plt.xlabel('Dam Capacity from Vegetation FIS')
+    plt.ylabel('Membership')
+    plt.legend()
+    plt.tight_layout()
+    plt.show()
+
+
+@lru_cache(maxsize=64)
+def build_vegetation_mfs(adj_type: str, adj_val: float) -> dict:
+    """
+    Build the adjusted vegetation FIS MFs. Each MF is held as (function, parameters) so it can
+    be evaluated directly on the reach inputs. Cached, so the returned dictionary must not be modified
+    :param adj_type: Type of adjustment to apply ('scale' or 'shape')
+    :param adj_val: Value for the adjustment (scaling factor)
+    :return: Dictionary of (function, parameters) MFs keyed by FIS variable label then term
+    """
+
+    log = Logger('Vegetation FIS')
 
-    # Ensure vegetation inputs are within the 0-4 range
-    riparian_array[riparian_array < 0] = 0
-    riparian_array[riparian_array > 4] = 4
-    streamside_array[streamside_array < 0] = 0
-    streamside_array[streamside_array > 4] = 4
-
-    # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
-    riparian = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input1')     # to be adjusted
-    streamside = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input2')   # to be adjusted
-    density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')     # do not adjust output!
-
-    # build membership functions for each antecedent and consequent object --- apply adjustments here
-    
     # we do NOT adjust density
-    density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
-    density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
-    density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
-    density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
-    density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
+    mfs = {var: dict(terms) for var, terms in vegetation_mfs.items()}
 
     if adj_type == 'scale':
         # scaling equations:
@@ -141,264 +232,135 @@ def calculate_vegetation_fis_custom(feature_values: dict, streamside_field: str,
         #   trapezoids (a,b,c,d)
         #       a = b - ((b-a) * scalefactor)
         #       d = c + ((d-c) * scalefactor)
-        
+
         # scale trapezoids
         a0, b0, c0, d0 = 0, 0, 0.1, 1   # from standard MFs
         a1 = b0 - ((b0 - a0) * adj_val)
         d1 = c0 + ((d0 - c0) * adj_val)     # we do not change top (b or c)
-        riparian['unsuitable'] = fuzz.trapmf(riparian.universe, [a1, b0, c0, d1])
-        streamside['unsuitable'] = fuzz.trapmf(streamside.universe, [a1, b0, c0, d1])
-        
+        mfs['input1']['unsuitable'] = (trap_mf, [a1, b0, c0, d1])
+        mfs['input2']['unsuitable'] = (trap_mf, [a1, b0, c0, d1])
+
         # scale triangles iteratively
         tri_centers = {     # from standard MFs
             'barely': [0.1, 1, 2],
-            'moderately': [1, 2, 3], 
+            'moderately': [1, 2, 3],
             'suitable': [2, 3, 4],
             'preferred': [3, 4, 4]
         }
         for cat, abc in tri_centers.items():
             b = abc[1]      # we do not change the top of the triangle since we don't want to shift
             a = b - ((b - abc[0]) * adj_val)
-            c = b -((abc[2] - b) * adj_val)
-            riparian[cat] = fuzz.trimf(riparian.universe, a, b, c)
-            streamside[cat] = fuzz.trimf(streamside.universe, a, b, c)  # MFs are identical
+            c = b + ((abc[2] - b) * adj_val)
+            mfs['input1'][cat] = (tri_mf, [a, b, c])
+            mfs['input2'][cat] = (tri_mf, [a, b, c])  # MFs are identical
 
     elif adj_type == 'shape':
         log.info("Running custom-defined MF shapes.")
         # CUSTOM SHAPES DEFINED HERE
-        riparian['unsuitable'] = fuzz.gbellmf(riparian.universe, 0.4, 2, 0.1)
-        riparian['barely'] = fuzz.gaussmf(riparian.universe, 1, .4)
-        riparian['moderately'] = fuzz.gaussmf(riparian.universe, 2, .4)
-        riparian['suitable'] = fuzz.gaussmf(riparian.universe, 3, .4)
-        riparian['preferred'] = fuzz.gaussmf(riparian.universe, 4, .4)
-
-        streamside['unsuitable'] = fuzz.gbellmf(riparian.universe, 0.4, 2, 0.1)
-        streamside['barely'] = fuzz.gaussmf(streamside.universe, 1, .4)
-        streamside['moderately'] = fuzz.gaussmf(streamside.universe, 2, .4)
-        streamside['suitable'] = fuzz.gaussmf(streamside.universe, 3, .4)
-        streamside['preferred'] = fuzz.gaussmf(streamside.universe, 4, .4)
-
-    
-
-    # build fis rule table --- we don't adjust this for FIS SA
-    veg_ctrl = ctrl.ControlSystem([
-        ctrl.Rule(riparian['unsuitable'] & streamside['unsuitable'], density['none']),
-        ctrl.Rule(riparian['barely'] & streamside['unsuitable'], density['rare']),
-        ctrl.Rule(riparian['moderately'] & streamside['unsuitable'], density['rare']),
-        ctrl.Rule(riparian['suitable'] & streamside['unsuitable'], density['occasional']),
-        ctrl.Rule(riparian['preferred'] & streamside['unsuitable'], density['occasional']),
-        ctrl.Rule(riparian['unsuitable'] & streamside['barely'], density['rare']),
-        ctrl.Rule(riparian['barely'] & streamside['barely'], density['rare']),  # matBRAT has consequnt as 'occasional'
-        ctrl.Rule(riparian['moderately'] & streamside['barely'], density['occasional']),
-        ctrl.Rule(riparian['suitable'] & streamside['barely'], density['occasional']),
-        ctrl.Rule(riparian['preferred'] & streamside['barely'], density['occasional']),
-        ctrl.Rule(riparian['unsuitable'] & streamside['moderately'], density['rare']),
-        ctrl.Rule(riparian['barely'] & streamside['moderately'], density['occasional']),
-        ctrl.Rule(riparian['moderately'] & streamside['moderately'], density['occasional']),
-        ctrl.Rule(riparian['suitable'] & streamside['moderately'], density['frequent']),
-        ctrl.Rule(riparian['preferred'] & streamside['moderately'], density['frequent']),
-        ctrl.Rule(riparian['unsuitable'] & streamside['suitable'], density['occasional']),
-        ctrl.Rule(riparian['barely'] & streamside['suitable'], density['occasional']),
-        ctrl.Rule(riparian['moderately'] & streamside['suitable'], density['frequent']),
-        ctrl.Rule(riparian['suitable'] & streamside['suitable'], density['frequent']),
-        ctrl.Rule(riparian['preferred'] & streamside['suitable'], density['pervasive']),
-        ctrl.Rule(riparian['unsuitable'] & streamside['preferred'], density['occasional']),
-        ctrl.Rule(riparian['barely'] & streamside['preferred'], density['frequent']),
-        ctrl.Rule(riparian['moderately'] & streamside['preferred'], density['pervasive']),
-        ctrl.Rule(riparian['suitable'] & streamside['preferred'], density['pervasive']),
-        ctrl.Rule(riparian['preferred'] & streamside['preferred'], density['pervasive'])
-    ])
-    veg_fis = ctrl.ControlSystemSimulation(veg_ctrl)
-
-    # calculate defuzzified centroid value for density 'none' MF group
-    # this will be used to re-classify output values that fall in this group
-    # important: will need to update the array (x) and MF values (mfx) if the
-    #            density 'none' values are changed in the model
-    x_vals = np.arange(0, 45, 0.01)
-    mfx = fuzz.trimf(x_vals, [0, 0, 0.1])
-    defuzz_centroid = round(fuzz.defuzz(x_vals, mfx, 'centroid'), 6)
-
-    mfx_pervasive = fuzz.trapmf(x_vals, [12, 25, 45, 45])
-    defuzz_pervasive = round(fuzz.defuzz(x_vals, mfx_pervasive, 'centroid'))
-
-    # run fuzzy inference system on inputs and defuzzify output
-    progbar = ProgressBar(len(reachid_array), 50, "Vegetation FIS")
-    counter = 0
-    for i, reach_id in enumerate(reachid_array):
-        veg_fis.input['input1'] = riparian_array[i]
-        veg_fis.input['input2'] = streamside_array[i]
-        veg_fis.compute()
-        result = veg_fis.output['result']
-
-        # set ovc_* to 0 if output falls fully in 'none' category and to 40 if falls fully in 'pervasive' category
-        if round(result, 6) == defuzz_centroid:
-            result = 0.0
-
-        if round(result) >= defuzz_pervasive:
-            result = 40.0
-
-        feature_values[reach_id][out_field] = round(result, 2)
-
-        counter += 1
-        progbar.update(counter)
-
-    progbar.finish()
-    log.info('Custom Veg FIS Done')
-    
-    '''VISUALIZE MEMBERSHIP FUNCTIONS'''
-    log.info('Visualizing Adjusted MFs...')
-    
-    # Riparian
-    for label, color in zip(list(riparian.terms.keys()), ['r', 'orange', 'y', 'g', 'b']):
-        plt.plot(riparian.universe, riparian.terms[label].mf, color=color, linewidth=1.5, label=label.capitalize())
-    plt.xlabel('Riparian (100m) Suitability')
-    plt.ylabel('Membership')
-    plt.legend(loc='upper right')
-    plt.tight_layout()
-    plt.show()
-
-    # Streamside
-    for label, color in zip(list(streamside.terms.keys()), ['r', 'orange', 'y', 'g', 'b']):
-        plt.plot(streamside.universe, streamside.terms[label].mf, color=color, linewidth=1.5, label=label.capitalize())
-    plt.xlabel('Streamside (30m) Suitability')
-    plt.ylabel('Membership')
-    plt.legend(loc='upper right')
-    plt.tight_layout()
-    plt.show()
+        shape_mfs = {
+            'unsuitable': (gbell_mf, [0.4, 2, 0.1]),
+            'barely': (gauss_mf, [1, .4]),
+            'moderately': (gauss_mf, [2, .4]),
+            'suitable': (gauss_mf, [3, .4]),
+            'preferred': (gauss_mf, [4, .4])
+        }
+        mfs['input1'] = shape_mfs
+        mfs['input2'] = shape_mfs  # MFs are identical
 
-    # Density
-    fig, axs = plt.subplots(1, 1, figsize=(12, 4))
-    for label, color in zip(list(density.terms.keys()), ['r', 'orange', 'y', 'g', 'b']):
-        axs.plot(density.universe, density.terms[label].mf, color=color, linewidth=1.5, label=label.capitalize())
-    plt.xlabel('Dam Capacity from Vegetation FIS')
-    plt.ylabel('Membership')
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
-    
+    check_mf_order(mfs)
 
+    return mfs
 
 
 # the standard Veg FIS from sqlBRAT
-def calculate_vegegtation_fis(feature_values: dict, streamside_field: str, riparian_field: str, out_field: str):
+def calculate_vegegtation_fis(feature_values: dict, streamside_field: str, riparian_field: str, out_field: str, mfs: dict = None):
     """
     Beaver dam capacity vegetation FIS
     :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
     :param streamside_field: Name of the feature streamside vegetation attribute
     :param riparian_field: Name of the riparian vegetation attribute
+    :param mfs: Adjusted MFs from build_vegetation_mfs, or None for the standard vegetation FIS
     :return: Inserts 'FIS' key into feature dictionaries with the vegetation FIS values
     """
 
     log = Logger('Vegetation FIS')
 
-    feature_count = len(feature_values)
-    reachid_array = np.zeros(feature_count, np.int64)
-    riparian_array = np.zeros(feature_count, np.float64)
-    streamside_array = np.zeros(feature_count, np.float64)
+    if mfs is None:
+        mfs = vegetation_mfs
 
-    counter = 0
-    for reach_id, values in feature_values.items():
-        reachid_array[counter] = reach_id
-        riparian_array[counter] = values[riparian_field]
-        streamside_array[counter] = values[streamside_field]
-        counter += 1
+    reachid_array, riparian_array, streamside_array = _extract_arrays(feature_values, streamside_field, riparian_field)
 
     # Ensure vegetation inputs are within the 0-4 range
-    riparian_array[riparian_array < 0] = 0
-    riparian_array[riparian_array > 4] = 4
-    streamside_array[streamside_array < 0] = 0
-    streamside_array[streamside_array > 4] = 4
-
-    # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
-    riparian = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input1')
-    streamside = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input2')
-    density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')
-
-    # build membership functions for each antecedent and consequent object
-    riparian['unsuitable'] = fuzz.trapmf(riparian.universe, [0, 0, 0.1, 1])
-    riparian['barely'] = fuzz.trimf(riparian.universe, [0.1, 1, 2])
-    riparian['moderately'] = fuzz.trimf(riparian.universe, [1, 2, 3])
-    riparian['suitable'] = fuzz.trimf(riparian.universe, [2, 3, 4])
-    riparian['preferred'] = fuzz.trimf(riparian.universe, [3, 4, 4])
-
-    streamside['unsuitable'] = fuzz.trapmf(streamside.universe, [0, 0, 0.1, 1])
-    streamside['barely'] = fuzz.trimf(streamside.universe, [0.1, 1, 2])
-    streamside['moderately'] = fuzz.trimf(streamside.universe, [1, 2, 3])
-    streamside['suitable'] = fuzz.trimf(streamside.universe, [2, 3, 4])
-    streamside['preferred'] = fuzz.trimf(streamside.universe, [3, 4, 4])
-
-    density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
-    density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
-    density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
-    density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
-    density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
-
-    # build fis rule table
-    veg_ctrl = ctrl.ControlSystem([
-        ctrl.Rule(riparian['unsuitable'] & streamside['unsuitable'], density['none']),
-        ctrl.Rule(riparian['barely'] & streamside['unsuitable'], density['rare']),
-        ctrl.Rule(riparian['moderately'] & streamside['unsuitable'], density['rare']),
-        ctrl.Rule(riparian['suitable'] & streamside['unsuitable'], density['occasional']),
-        ctrl.Rule(riparian['preferred'] & streamside['unsuitable'], density['occasional']),
-        ctrl.Rule(riparian['unsuitable'] & streamside['barely'], density['rare']),
-        ctrl.Rule(riparian['barely'] & streamside['barely'], density['rare']),  # matBRAT has consequnt as 'occasional'
-        ctrl.Rule(riparian['moderately'] & streamside['barely'], density['occasional']),
-        ctrl.Rule(riparian['suitable'] & streamside['barely'], density['occasional']),
-        ctrl.Rule(riparian['preferred'] & streamside['barely'], density['occasional']),
-        ctrl.Rule(riparian['unsuitable'] & streamside['moderately'], density['rare']),
-        ctrl.Rule(riparian['barely'] & streamside['moderately'], density['occasional']),
-        ctrl.Rule(riparian['moderately'] & streamside['moderately'], density['occasional']),
-        ctrl.Rule(riparian['suitable'] & streamside['moderately'], density['frequent']),
-        ctrl.Rule(riparian['preferred'] & streamside['moderately'], density['frequent']),
-        ctrl.Rule(riparian['unsuitable'] & streamside['suitable'], density['occasional']),
-        ctrl.Rule(riparian['barely'] & streamside['suitable'], density['occasional']),
-        ctrl.Rule(riparian['moderately'] & streamside['suitable'], density['frequent']),
-        ctrl.Rule(riparian['suitable'] & streamside['suitable'], density['frequent']),
-        ctrl.Rule(riparian['preferred'] & streamside['suitable'], density['pervasive']),
-        ctrl.Rule(riparian['unsuitable'] & streamside['preferred'], density['occasional']),
-        ctrl.Rule(riparian['barely'] & streamside['preferred'], density['frequent']),
-        ctrl.Rule(riparian['moderately'] & streamside['preferred'], density['pervasive']),
-        ctrl.Rule(riparian['suitable'] & streamside['preferred'], density['pervasive']),
-        ctrl.Rule(riparian['preferred'] & streamside['preferred'], density['pervasive'])
-    ])
-    veg_fis = ctrl.ControlSystemSimulation(veg_ctrl)
-
-    # calculate defuzzified centroid value for density 'none' MF group
-    # this will be used to re-classify output values that fall in this group
-    # important: will need to update the array (x) and MF values (mfx) if the
-    #            density 'none' values are changed in the model
-    x_vals = np.arange(0, 45, 0.01)
-    mfx = fuzz.trimf(x_vals, [0, 0, 0.1])
-    defuzz_centroid = round(fuzz.defuzz(x_vals, mfx, 'centroid'), 6)
-
-    mfx_pervasive = fuzz.trapmf(x_vals, [12, 25, 45, 45])
-    defuzz_pervasive = round(fuzz.defuzz(x_vals, mfx_pervasive, 'centroid'))
-
-    # run fuzzy inference system on inputs and defuzzify output
-    progbar = ProgressBar(len(reachid_array), 50, "Vegetation FIS")
-    counter = 0
-    for i, reach_id in enumerate(reachid_array):
-        veg_fis.input['input1'] = riparian_array[i]
-        veg_fis.input['input2'] = streamside_array[i]
-        veg_fis.compute()
-        result = veg_fis.output['result']
-
-        # set ovc_* to 0 if output falls fully in 'none' category and to 40 if falls fully in 'pervasive' category
-        if round(result, 6) == defuzz_centroid:
-            result = 0.0
-
-        if round(result) >= defuzz_pervasive:
-            result = 40.0
-
-        feature_values[reach_id][out_field] = round(result, 2)
-
-        counter += 1
-        progbar.update(counter)
-
-    progbar.finish()
+    np.clip(riparian_array, 0, 4, out=riparian_array)
+    np.clip(streamside_array, 0, 4, out=streamside_array)
+
+    # run fuzzy inference system on all inputs at once and defuzzify output
+    result_array = vegetation_fis_capacity(riparian_array, streamside_array, mfs)
+    for reach_id, result in zip(reachid_array.tolist(), np.round(result_array, 2).tolist()):
+        feature_values[reach_id][out_field] = result
+
     log.info('Done')
 
 
+def _extract_arrays(feature_values: dict, streamside_field: str, riparian_field: str):
+    """
+    Pull the vegetation FIS inputs out of the feature dictionary in a single pass
+    :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
+    :param streamside_field: Name of the feature streamside vegetation attribute
+    :param riparian_field: Name of the riparian vegetation attribute
+    :return: Arrays of reach IDs, riparian and streamside vegetation suitability
+    """
+
+    feature_count = len(feature_values)
+    getter = itemgetter(riparian_field, streamside_field)
+    rows = np.fromiter((getter(values) for values in feature_values.values()), count=feature_count,
+                       dtype=[('riparian', np.float64), ('streamside', np.float64)])
+    reachid_array = np.fromiter(feature_values.keys(), np.int64, count=feature_count)
+
+    return reachid_array, rows['riparian'].copy(), rows['streamside'].copy()
+
+
+def vegetation_fis_capacity(riparian_array: np.ndarray, streamside_array: np.ndarray, mfs: dict) -> np.ndarray:
+    """
+    Run the vegetation FIS and defuzzify the density for all features at once
+    :param riparian_array: Riparian (100m) vegetation suitability of each feature
+    :param streamside_array: Streamside (30m) vegetation suitability of each feature
+    :param mfs: Dictionary of (function, parameters) MFs keyed by FIS variable label then term
+    :return: Array of vegetation dam capacity for each feature
+    """
+
+    # the skfuzzy universes stopped at 3.99 and clipped inputs to it, so a 4 was only 0.99 'preferred'.
+    # Keep that so results match the standard sqlBRAT vegetation FIS
+    riparian_array = np.minimum(riparian_array, vegetation_input_max)
+    streamside_array = np.minimum(streamside_array, vegetation_input_max)
+
+    # membership of every input in every term (terms x features). Piecewise linear MFs are evaluated
+    # for all their terms in one pass from a packed parameter table
+    memberships = {}
+    for var, values in [('input1', riparian_array), ('input2', streamside_array)]:
+        params = trap_params([mfs[var][term] for term in vegetation_terms])
+        if params is not None:
+            memberships[var] = trap_mf_table(values, params)
+        else:
+            memberships[var] = np.stack([mfs[var][term][0](values, *mfs[var][term][1]) for term in vegetation_terms])
+    mu_riparian, mu_streamside = memberships['input1'], memberships['input2']
+
+    # each rule fires at the min (AND) of its two terms and each density term takes the max of its rules
+    activations = np.zeros((len(density_terms), riparian_array.size))
+    for (riparian_term, streamside_term), density_term in np.ndenumerate(vegetation_rule_table):
+        np.fmax(activations[density_term], np.fmin(mu_riparian[riparian_term], mu_streamside[streamside_term]), out=activations[density_term])
+    activations = activations.T
+
+    result_array = density_centroid(activations)
+
+    # set ovc_* to 0 if output falls fully in 'none' category and to 40 if falls fully in 'pervasive' category
+    defuzz_pervasive = round(density_centroid(np.eye(len(density_terms))[-1:])[0])
+    result_array[activations[:, 1:].max(axis=1) < 1e-9] = 0.0
+    result_array[np.round(result_array) >= defuzz_pervasive] = 40.0
+
+    return result_array
+
+
 def main():
     """ Main Vegetation FIS
     """
@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+from unittest import mock
+import numpy as np
+from sqlbrat.utils import combined_fis as reference
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+import fis_helpers  # noqa: E402
+import combined_fis_custom  # noqa: E402
+
+
+def _random_features(count: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    veg = rng.uniform(0, 45, count)
+    veg[::10] = 0
+    return {reach_id + 1: {
+        'oVC_EX': veg[reach_id],
+        'iHyd_SP2': rng.uniform(0, 3000),
+        'iHyd_SPLow': rng.uniform(0, 250),
+        'iGeo_Slope': rng.uniform(0, 0.3),
+        'iGeo_DA': rng.uniform(0, 500),
+        'iGeo_Len': rng.uniform(10, 2000),
+        'ReachCode': 33600 if reach_id % 7 == 0 else 46006
+    } for reach_id in range(count)}
+
+
+def _capacity(features: dict, calculate, *args) -> dict:
+    features = {reach_id: dict(values) for reach_id, values in features.items()}
+    calculate(features, 'oVC_EX', 'oCC_EX', 'mCC_EX_CT', 250, *args)
+    return {reach_id: values['oCC_EX'] for reach_id, values in features.items()}
+
+
+class TestCombinedFisCustom(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.features = _random_features(500)
+        cls.expected = _capacity(cls.features, reference.calculate_combined_fis)
+
+    def assert_matches_reference(self, capacity: dict):
+        for reach_id, expected in self.expected.items():
+            if capacity[reach_id] == 0:
+                # reaches where only the 'none' rules fire are zero rather than the 'none' centroid
+                self.assertLessEqual(expected, 0.05, reach_id)
+            else:
+                self.assertAlmostEqual(capacity[reach_id], expected, delta=0.0101, msg=reach_id)
+
+    def test_calculate_combined_fis(self):
+        self.assert_matches_reference(_capacity(self.features, combined_fis_custom.calculate_combined_fis))
+
+    def test_calculate_combined_fis_numpy(self):
+        with mock.patch.object(combined_fis_custom, 'njit', None), mock.patch.object(fis_helpers, 'njit', None):
+            self.assert_matches_reference(_capacity(self.features, combined_fis_custom.calculate_combined_fis))
+
+    def test_unadjusted_shift(self):
+        capacity = _capacity(self.features, combined_fis_custom.calculate_combined_fis)
+        shifted = _capacity(self.features, combined_fis_custom.calculate_combined_fis_custom, 'shift', [0, 0, 0])
+        self.assertEqual(shifted, capacity)
+
+    def test_unit_scale(self):
+        capacity = _capacity(self.features, combined_fis_custom.calculate_combined_fis)
+        scaled = _capacity(self.features, combined_fis_custom.calculate_combined_fis_custom, 'scale', [1, 1, 1])
+        self.assertEqual(scaled, capacity)
+
+    def test_invalid_scale_factor(self):
+        with self.assertRaises(ValueError):
+            combined_fis_custom.combined_fis('unused.sqlite', 'Existing', 'EX', 250, adjustment_type='scale', adjustment_values=[1, 0, 1])
+
+    def test_missing_scale_factors(self):
+        with self.assertRaises(ValueError):
+            combined_fis_custom.combined_fis('unused.sqlite', 'Existing', 'EX', 250, adjustment_type='scale', adjustment_values=[2])
+
+    def test_out_of_order_shift(self):
+        # shifting slope left past the 'flat' shoulder puts its parameters out of order
+        with self.assertRaises(ValueError):
+            combined_fis_custom.combined_fis('unused.sqlite', 'Existing', 'EX', 250, adjustment_type='shift', adjustment_values=[0, 0, -0.001])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import unittest
+from unittest import mock
+import numpy as np
+from sqlbrat.utils import vegetation_fis as reference
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+import fis_helpers  # noqa: E402
+import vegetation_fis_custom  # noqa: E402
+
+
+def _random_features(count: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    # vegetation suitability is mostly whole classes, with some out of range and fractional values
+    values = np.where(rng.random((count, 2)) < 0.5, rng.integers(0, 5, (count, 2)), rng.uniform(-1, 5, (count, 2)))
+    return {reach_id + 1: {'iVeg_30EX': streamside, 'iVeg100EX': riparian} for reach_id, (streamside, riparian) in enumerate(values.tolist())}
+
+
+def _capacity(features: dict, calculate, *args) -> dict:
+    features = {reach_id: dict(values) for reach_id, values in features.items()}
+    calculate(features, 'iVeg_30EX', 'iVeg100EX', 'oVC_EX', *args)
+    return {reach_id: values['oVC_EX'] for reach_id, values in features.items()}
+
+
+class TestVegetationFisCustom(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.features = _random_features(500)
+        cls.expected = _capacity(cls.features, reference.calculate_vegegtation_fis)
+
+    def assert_matches_reference(self, capacity: dict):
+        for reach_id, expected in self.expected.items():
+            self.assertAlmostEqual(capacity[reach_id], expected, delta=0.0101, msg=reach_id)
+
+    def test_calculate_vegetation_fis(self):
+        self.assert_matches_reference(_capacity(self.features, vegetation_fis_custom.calculate_vegegtation_fis))
+
+    def test_calculate_vegetation_fis_numpy(self):
+        with mock.patch.object(fis_helpers, 'njit', None):
+            self.assert_matches_reference(_capacity(self.features, vegetation_fis_custom.calculate_vegegtation_fis))
+
+    def test_unit_scale(self):
+        capacity = _capacity(self.features, vegetation_fis_custom.calculate_vegegtation_fis)
+        scaled = _capacity(self.features, vegetation_fis_custom.calculate_vegetation_fis_custom, 'scale', 1.0)
+        for reach_id, expected in capacity.items():
+            self.assertAlmostEqual(scaled[reach_id], expected, delta=1e-9, msg=reach_id)
+
+    def test_out_of_order_mfs(self):
+        with self.assertRaises(ValueError):
+            vegetation_fis_custom.build_vegetation_mfs('scale', -1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()